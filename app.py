@@ -1,17 +1,35 @@
+import startup  # ⏱️ первым: от него считается время старта
 import os
 import asyncio
-from flask import Flask, send_file, request
 import logging
-import csv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import Response, JSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.middleware import Middleware
 from dotenv import load_dotenv
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
+from config_cache import TournamentConfigCache
+from sheets_writer import SheetsWriter
+from state_store import STATE_STORE, STATE_DB_FILE, WEB_CONCURRENCY, create_state_store
+from storage import ChatLocks
+from registration_store import CONFIRMED, WAITLIST, RegistrationStore
+from export import prepare_export
+from dedup import create_update_deduplicator, update_chat_id
+import metrics
+import contextvars
+from telegram_sender import TELEGRAM_API_URL, TelegramSender
+from broadcast import BROADCAST_CONCURRENCY, Broadcaster, admin_authorized
+from ptb_persistence import PerChatUpdateProcessor, StateStorePersistence, store_conversations
+import sheets
+from startup import StartupTimingMiddleware
 import telegram  # ✅ импортируем telegram напрямую
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, filters,
-    ContextTypes, ConversationHandler
+    ContextTypes, ConversationHandler, TypeHandler
 )
 
 # ✅ Загрузка переменных окружения
@@ -20,67 +38,106 @@ if os.environ.get("FLASK_ENV") != "production":
 
 logging.basicConfig(level=logging.INFO)
 
-app = Flask(__name__)
-
-user_data_confirmed = {}
 CONFIRMED_USERS_FILE = "confirmed_users.csv"
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", 8))
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 32))
+
+# Блокирующие вызовы (gspread, SQLite, файлы) выполняются в ограниченном пуле,
+# чтобы не останавливать общий event loop
+executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+async def run_blocking(func, *args):
+    # Контекст копируется, чтобы этапы из пула попадали в разбивку текущего запроса
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
+
+async def iterate_blocking(iterator):
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        chunk = await run_blocking(next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
 
-# 🔽 Настройка Google Sheets
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name("google-credentials.json", scope)
-client = gspread.authorize(creds)
-sheet = client.open("Турнир заявки").sheet1
-config_sheet = client.open("Турнир заявки").worksheet("config")
+# 🔽 Google Sheets открывается лениво, один раз на процесс (см. sheets.py)
+config_cache = TournamentConfigCache(sheets.get_config_sheet)
+sheets_writer = SheetsWriter(sheets.get_registrations_sheet)
+sheets_writer.start()
+registration_store = RegistrationStore(CONFIRMED_USERS_FILE)
+update_dedup = create_update_deduplicator()
+# Создаётся при импорте: STATE_STORE=memory при нескольких воркерах не даст запуститься сразу
+state_store = create_state_store()
+# Уведомления другим чатам и рассылки отправляются своими потоками и соединениями, мимо event loop PTB
+telegram_sender = TelegramSender(os.environ.get("TELEGRAM_BOT_TOKEN"))
+broadcaster = Broadcaster(
+    TelegramSender(os.environ.get("TELEGRAM_BOT_TOKEN"), workers=BROADCAST_CONCURRENCY, global_bucket=telegram_sender.global_bucket),
+    registration_store,
+)
+metrics.QUEUE_DEPTH.set_function(sheets_writer.pending_count, queue="sheets_writer")
+metrics.QUEUE_DEPTH.set_function(telegram_sender.queue_depth, queue="telegram_sender")
+metrics.QUEUE_DEPTH.set_function(lambda: application.update_queue.qsize(), queue="ptb_update_queue")
 
 def get_current_tournament():
-    try:
-        return config_sheet.acell("B1").value.strip()
-    except Exception as e:
-        logging.error(f"❌ Ошибка чтения турнира из Sheets: {e}")
-        return ""
+    return config_cache.get("current_tournament")
 
 def get_tournament_description():
+    return config_cache.get("tournament_description")
+
+def get_tournament_capacity():
+    # Пустая или нечисловая ячейка — мест без ограничения
     try:
-        return config_sheet.acell("B2").value.strip()
-    except Exception as e:
-        logging.error(f"❌ Ошибка чтения описания турнира из Sheets: {e}")
-        return ""
+        return max(int(config_cache.get("tournament_capacity") or 0), 0)
+    except ValueError:
+        return 0
+
+def notify_promoted(promoted):
+    for row, chat_id in promoted:
+        sheets_writer.enqueue(row)
+        if chat_id is not None:
+            telegram_sender.send_message(chat_id, f"🎉 Освободилось место! Ваша заявка на турнир '{row[3]}' подтверждена.")
 
 def save_confirmed_user_to_file(user_id, data):
-    is_new_file = not os.path.exists(CONFIRMED_USERS_FILE)
     timestamp = datetime.utcnow() + timedelta(hours=5)
     date_str = timestamp.strftime("%Y-%m-%d")
     time_str = timestamp.strftime("%H:%M:%S")
+    tournament = get_current_tournament()
 
-    with open(CONFIRMED_USERS_FILE, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if is_new_file:
-            writer.writerow(["Номер", "Имя", "Фамилия", "Турнир", "Дата", "Время"])
-        writer.writerow([
-            data.get("phone", ""),
-            data.get("name", ""),
-            data.get("surname", ""),
-            get_current_tournament(),
-            date_str,
-            time_str
-        ])
+    row = [
+        data.get("phone", ""),
+        data.get("name", ""),
+        data.get("surname", ""),
+        tournament,
+        date_str,
+        time_str
+    ]
 
-    try:
-        sheet.append_row([
-            data.get("phone", ""),
-            data.get("name", ""),
-            data.get("surname", ""),
-            get_current_tournament(),
-            date_str,
-            time_str
-        ])
-        logging.info("📄 Добавлено в Google Sheets")
-    except Exception as e:
-        logging.error(f"❌ Ошибка записи в Google Sheets: {e}")
+    status, promoted = registration_store.add(row, chat_id=user_id, capacity=get_tournament_capacity())
+    notify_promoted(promoted)
+    if status is None:
+        logging.info(f"ℹ️ Номер {row[0]} уже зарегистрирован на турнир '{tournament}'")
+    elif status == CONFIRMED:
+        # В Sheets строка уходит фоновым потоком, вебхук не ждёт Google
+        sheets_writer.enqueue(row)
+    return status
+
+def promote_waitlist():
+    notify_promoted(registration_store.promote(get_current_tournament(), get_tournament_capacity()))
+
+def cancel_registration(user_id):
+    tournament = get_current_tournament()
+    cancelled, promoted = registration_store.cancel(user_id, tournament, capacity=get_tournament_capacity())
+    for row, status in cancelled:
+        if status == CONFIRMED:
+            # Sheets только дописывается — отмену отмечаем отдельной строкой
+            sheets_writer.enqueue(row + ["Отменена"])
+    notify_promoted(promoted)
+    return tournament, cancelled
 
 # Telegram bot logic
 WAIT_PHONE, WAIT_NAME, WAIT_SURNAME, CONFIRM = range(4)
 
+@metrics.timed_state("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     button = KeyboardButton("📱 Отправить номер", request_contact=True)
     reply_markup = ReplyKeyboardMarkup([[button]], one_time_keyboard=True, resize_keyboard=True)
@@ -90,6 +147,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return WAIT_PHONE
 
+@metrics.timed_state("wait_phone")
 async def receive_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     contact = update.message.contact
     if contact and contact.phone_number:
@@ -101,21 +159,30 @@ async def receive_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, нажмите кнопку и отправьте номер.")
         return WAIT_PHONE
 
+@metrics.timed_state("wait_name")
 async def wait_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["name"] = update.message.text
     await update.message.reply_text("Отлично! Теперь введите свою фамилию:")
     return WAIT_SURNAME
 
+@metrics.timed_state("wait_surname")
 async def wait_surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["surname"] = update.message.text
-    tournament = get_current_tournament()
+    tournament = await run_blocking(get_current_tournament)
     await update.message.reply_text(f"Вы уверены, что хотите зарегистрироваться на турнир '{tournament}'? Ответьте 1 — Да, 2 — Нет.")
     return CONFIRM
 
+@metrics.timed_state("confirm")
 async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text.strip() == '1':
-        save_confirmed_user_to_file(update.effective_user.id, context.user_data)
-        await update.message.reply_text("✅ Ваша заявка принята! Спасибо!")
+        status = await run_blocking(save_confirmed_user_to_file, update.effective_user.id, context.user_data)
+        if status == CONFIRMED:
+            await update.message.reply_text("✅ Ваша заявка принята! Спасибо!")
+        elif status == WAITLIST:
+            await update.message.reply_text("📝 Все места на турнир заняты — вы в листе ожидания. Мы напишем, если место освободится.")
+        else:
+            tournament = await run_blocking(get_current_tournament)
+            await update.message.reply_text(f"ℹ️ Этот номер уже зарегистрирован на турнир '{tournament}'.")
     else:
         await update.message.reply_text("❌ Операция отменена.")
     return ConversationHandler.END
@@ -124,50 +191,171 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Регистрация отменена.")
     return ConversationHandler.END
 
-@app.route("/export", methods=["GET"])
-def export_users():
-    if not os.path.exists(CONFIRMED_USERS_FILE):
-        return "Нет данных для выгрузки", 200
+async def unregister(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tournament, cancelled = await run_blocking(cancel_registration, update.effective_user.id)
+    if cancelled:
+        await update.message.reply_text(f"❌ Ваша заявка на турнир '{tournament}' отменена.")
+    else:
+        await update.message.reply_text(f"ℹ️ У вас нет заявки на турнир '{tournament}'.")
 
-    return send_file(
-        CONFIRMED_USERS_FILE,
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name="users.csv"
-    )
+async def export_users(request):
+    # ?tournament=&status=&from=&to=&format=csv|json|xlsx, строки отдаются потоком
+    status, headers, body = await run_blocking(prepare_export, registration_store, request.query_params, request.headers)
+    if status == 304:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(iterate_blocking(body), status_code=status, headers=headers)
 
-@app.route("/ping")
-def ping():
-    return "", 204
+async def ping(request):
+    return Response(status_code=204)
 
-@app.route(f"/webhook/{os.environ['TELEGRAM_BOT_TOKEN']}", methods=["POST"])
-async def telegram_webhook():
-    data = await request.get_json()
-    update = telegram.Update.de_json(data, application.bot)
-    await application.process_update(update)
-    return "", 204
+async def metrics_endpoint(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-async def init_webhook():
-    print("✅ Новый код загружен! (init_webhook)")
+async def ready(request):
+    # /ping — процесс жив, /ready — PTB запущен, Sheets открыт и можно принимать трафик
+    is_ready = application is not None and application.running and sheets.is_ready()
+    if not is_ready:
+        sheets.warm_up()
+    return JSONResponse({"ready": is_ready, "startup": startup.report()}, status_code=200 if is_ready else 503)
+
+async def refresh_config(request):
+    if not admin_authorized(request.headers):
+        return JSONResponse({"ok": False}, status_code=403)
+    ok = await run_blocking(config_cache.invalidate)
+    if ok:
+        # Вместимость могла вырасти — свободные места сразу получает лист ожидания
+        await run_blocking(promote_waitlist)
+    config = await run_blocking(config_cache.values)
+    return JSONResponse({"ok": ok, "config": config}, status_code=200 if ok else 503)
+
+async def create_broadcast(request):
+    if not admin_authorized(request.headers):
+        return JSONResponse({"ok": False}, status_code=403)
+    try:
+        params = await request.json()
+    except ValueError:
+        params = {}
+    if not isinstance(params, dict):
+        return JSONResponse({"ok": False, "error": "ожидается JSON-объект"}, status_code=400)
+    # По умолчанию — описание текущего турнира всем, кто на него ещё не записан.
+    # На холодном кэше конфиг ждёт Sheets — не на event loop
+    text = params.get("text") or await run_blocking(get_tournament_description)
+    if not text:
+        return JSONResponse({"ok": False, "error": "нет текста рассылки"}, status_code=400)
+    exclude = await run_blocking(get_current_tournament) if params.get("exclude_registered", True) else None
+    status, error = await run_blocking(broadcaster.create, text, exclude)
+    if error:
+        return JSONResponse({"ok": False, "error": error}, status_code=409)
+    return JSONResponse({"ok": True, "broadcast": status}, status_code=202)
+
+async def broadcast_status(request):
+    if not admin_authorized(request.headers):
+        return JSONResponse({"ok": False}, status_code=403)
+    status = await run_blocking(broadcaster.status, request.path_params["broadcast_id"])
+    return JSONResponse({"ok": bool(status), "broadcast": status}, status_code=200 if status else 404)
+
+async def cancel_broadcast(request):
+    if not admin_authorized(request.headers):
+        return JSONResponse({"ok": False}, status_code=403)
+    status = await run_blocking(broadcaster.cancel, request.path_params["broadcast_id"])
+    return JSONResponse({"ok": bool(status), "broadcast": status}, status_code=200 if status else 404)
+
+async def telegram_webhook(request):
+    # Апдейт кладётся в очередь PTB и обрабатывается в том же event loop, ответ Telegram — сразу
+    data = await request.json()
+    # Telegram повторяет апдейт, если вебхук отвечал долго — второй раз не обрабатываем
+    with metrics.stage("dedup"):
+        duplicate = "update_id" in data and await run_blocking(update_dedup.seen, data["update_id"], update_chat_id(data))
+    if duplicate:
+        return Response(status_code=204)
+    await application.update_queue.put(telegram.Update.de_json(data, application.bot))
+    return Response(status_code=204)
+
+@asynccontextmanager
+async def lifespan(app):
+    global application
+    print("✅ Новый код загружен! (lifespan)")
+    sheets.warm_up()
+    broadcaster.start()
+    application = build_application()
     await application.initialize()
-    await application.bot.set_webhook(url=f"{os.environ['RENDER_EXTERNAL_URL']}/webhook/{os.environ['TELEGRAM_BOT_TOKEN']}")
-    print("🚀 Вебхук установлен!")
+    await application.start()
+    startup.mark("application_started")
+    try:
+        await application.bot.set_webhook(url=f"{os.environ['RENDER_EXTERNAL_URL']}/webhook/{os.environ['TELEGRAM_BOT_TOKEN']}")
+        print("🚀 Вебхук установлен!")
+    except telegram.error.TelegramError as e:
+        logging.error(f"❌ Не удалось установить вебхук: {e}")
+    yield
+    await application.stop()
+    await application.shutdown()
+    executor.shutdown(wait=False)
+
+async def start_update_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    metrics.start_request()
+
+async def finish_update_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    metrics.finish_request("update")
 
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-
-conv_handler = ConversationHandler(
-    entry_points=[CommandHandler("start", start)],
-    states={
-        WAIT_PHONE: [MessageHandler(filters.CONTACT, receive_phone)],
-        WAIT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, wait_name)],
-        WAIT_SURNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, wait_surname)],
-        CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm)]
-    },
-    fallbacks=[CommandHandler("cancel", cancel)]
+application = None  # создаётся в lifespan, а не при импорте
+
+def build_application():
+    # Несколько воркеров uvicorn: чат на время апдейта блокируется и между процессами
+    chat_locks = ChatLocks(f"{STATE_DB_FILE}.lock") if STATE_STORE == "sqlite" else None
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .persistence(StateStorePersistence(state_store))
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES, chat_locks))
+        .updater(None)
+        .build()
+    )
+
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("start", start)],
+        states={
+            WAIT_PHONE: [MessageHandler(filters.CONTACT, receive_phone)],
+            WAIT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, wait_name)],
+            WAIT_SURNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, wait_surname)],
+            CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm)]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="registration",
+        persistent=True
+    )
+    application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("unregister", unregister))
+    # Полное время обработки апдейта (и лог медленных) — от первой до последней группы обработчиков
+    application.add_handler(TypeHandler(Update, start_update_metrics), group=-2)
+    application.add_handler(TypeHandler(Update, finish_update_metrics), group=2)
+    # Состояние разговора и user_data живут только в store (ограничен TTL/LRU);
+    # при STATE_STORE=sqlite он общий для всех воркеров uvicorn
+    store_conversations(application, conv_handler)
+    return application
+
+app = Starlette(
+    routes=[
+        Route("/export", export_users, methods=["GET"]),
+        Route("/ping", ping),
+        Route("/ready", ready),
+        Route("/metrics", metrics_endpoint),
+        Route("/config/refresh", refresh_config, methods=["POST"]),
+        Route("/broadcast", create_broadcast, methods=["POST"]),
+        Route("/broadcast/{broadcast_id:int}", broadcast_status, methods=["GET"]),
+        Route("/broadcast/{broadcast_id:int}/cancel", cancel_broadcast, methods=["POST"]),
+        Route(f"/webhook/{TELEGRAM_TOKEN}", telegram_webhook, methods=["POST"]),
+    ],
+    lifespan=lifespan,
+    middleware=[Middleware(StartupTimingMiddleware), Middleware(metrics.MetricsMiddleware)],
 )
-application.add_handler(conv_handler)
+startup.mark("import_finished")
 
 if __name__ == "__main__":
-    asyncio.run(init_webhook())
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 10000)),
+        workers=WEB_CONCURRENCY
+    )
@@ -1,12 +1,20 @@
+import startup  # ⏱️ первым: от него считается время старта
 import os
-import requests
-from flask import Flask, send_file, request
+from flask import Flask, Response, request
 import logging
-import csv
 from dotenv import load_dotenv
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
+from config_cache import TournamentConfigCache
+from sheets_writer import SheetsWriter
+from telegram_sender import TelegramSender
+from state_store import create_state_store
+import sheets
+from registration_store import CONFIRMED, WAITLIST, RegistrationStore
+from export import prepare_export
+from dedup import create_update_deduplicator, update_chat_id
+from broadcast import BROADCAST_CONCURRENCY, Broadcaster, admin_authorized
+import metrics
+import time
 import re
 
 # ✅ Загрузка переменных окружения
@@ -17,91 +25,186 @@ logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 
-user_data_confirmed = {}
-user_states = {}  # состояние пользователя в чате
+state_store = create_state_store()  # состояние и данные пользователя в чате
+update_dedup = create_update_deduplicator()
 CONFIRMED_USERS_FILE = "confirmed_users.csv"
 
-# 🔽 Настройка Google Sheets
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name("google-credentials.json", scope)
-client = gspread.authorize(creds)
-sheet = client.open("Турнир заявки").sheet1
-config_sheet = client.open("Турнир заявки").worksheet("config")
+# 🔽 Google Sheets открывается лениво, один раз на процесс (см. sheets.py)
+config_cache = TournamentConfigCache(sheets.get_config_sheet)
+sheets_writer = SheetsWriter(sheets.get_registrations_sheet)
+sheets_writer.start()
+registration_store = RegistrationStore(CONFIRMED_USERS_FILE)
+telegram_sender = TelegramSender(os.environ["TELEGRAM_BOT_TOKEN"])
+telegram_sender.start()
+# Рассылки идут отдельными потоками и соединениями, но под общим лимитом бота
+broadcaster = Broadcaster(
+    TelegramSender(os.environ["TELEGRAM_BOT_TOKEN"], workers=BROADCAST_CONCURRENCY, global_bucket=telegram_sender.global_bucket),
+    registration_store,
+)
+broadcaster.start()
+metrics.QUEUE_DEPTH.set_function(sheets_writer.pending_count, queue="sheets_writer")
+metrics.QUEUE_DEPTH.set_function(telegram_sender.queue_depth, queue="telegram_sender")
 
 def get_current_tournament():
-    try:
-        return config_sheet.acell("B1").value.strip()
-    except Exception as e:
-        logging.error(f"❌ Ошибка чтения турнира из Sheets: {e}")
-        return ""
+    return config_cache.get("current_tournament")
 
 def get_tournament_description():
+    return config_cache.get("tournament_description")
+
+def get_tournament_capacity():
+    # Пустая или нечисловая ячейка — мест без ограничения
     try:
-        return config_sheet.acell("B2").value.strip()
-    except Exception as e:
-        logging.error(f"❌ Ошибка чтения описания турнира из Sheets: {e}")
-        return ""
+        return max(int(config_cache.get("tournament_capacity") or 0), 0)
+    except ValueError:
+        return 0
+
+def notify_promoted(promoted):
+    for row, chat_id in promoted:
+        sheets_writer.enqueue(row)
+        if chat_id is not None:
+            telegram_sender.send_message(chat_id, f"🎉 Освободилось место! Ваша заявка на турнир '{row[3]}' подтверждена.")
 
 def save_confirmed_user_to_file(user_id, data):
-    is_new_file = not os.path.exists(CONFIRMED_USERS_FILE)
     timestamp = datetime.utcnow() + timedelta(hours=5)
     date_str = timestamp.strftime("%Y-%m-%d")
     time_str = timestamp.strftime("%H:%M:%S")
+    tournament = get_current_tournament()
 
-    with open(CONFIRMED_USERS_FILE, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if is_new_file:
-            writer.writerow(["Номер", "Имя", "Фамилия", "Турнир", "Дата", "Время"])
-        writer.writerow([
-            data.get("phone", ""),
-            data.get("name", ""),
-            data.get("surname", ""),
-            get_current_tournament(),
-            date_str,
-            time_str
-        ])
+    row = [
+        data.get("phone", ""),
+        data.get("name", ""),
+        data.get("surname", ""),
+        tournament,
+        date_str,
+        time_str
+    ]
 
-    try:
-        sheet.append_row([
-            data.get("phone", ""),
-            data.get("name", ""),
-            data.get("surname", ""),
-            get_current_tournament(),
-            date_str,
-            time_str
-        ])
-        logging.info("📄 Добавлено в Google Sheets")
-    except Exception as e:
-        logging.error(f"❌ Ошибка записи в Google Sheets: {e}")
+    status, promoted = registration_store.add(row, chat_id=user_id, capacity=get_tournament_capacity())
+    notify_promoted(promoted)
+    if status is None:
+        logging.info(f"ℹ️ Номер {row[0]} уже зарегистрирован на турнир '{tournament}'")
+    elif status == CONFIRMED:
+        # В Sheets строка уходит фоновым потоком, вебхук не ждёт Google
+        sheets_writer.enqueue(row)
+    return status
+
+def cancel_registration(user_id):
+    tournament = get_current_tournament()
+    cancelled, promoted = registration_store.cancel(user_id, tournament, capacity=get_tournament_capacity())
+    for row, status in cancelled:
+        if status == CONFIRMED:
+            # Sheets только дописывается — отмену отмечаем отдельной строкой
+            sheets_writer.enqueue(row + ["Отменена"])
+    notify_promoted(promoted)
+    return tournament, cancelled
 
 @app.route("/export", methods=["GET"])
 def export_users():
-    if not os.path.exists(CONFIRMED_USERS_FILE):
-        return "Нет данных для выгрузки", 200
+    # ?tournament=&status=&from=&to=&format=csv|json|xlsx, строки отдаются потоком
+    status, headers, body = prepare_export(registration_store, request.args, request.headers)
+    return Response(body, status=status, headers=headers)
+
+@app.before_request
+def mark_first_request():
+    startup.first_request_started()
+    metrics.start_request()
 
-    return send_file(
-        CONFIRMED_USERS_FILE,
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name="users.csv"
-    )
+@app.after_request
+def mark_first_response(response):
+    startup.first_request_finished()
+    metrics.finish_request(request.endpoint or "not_found")
+    return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route("/ping")
 def ping():
     return "", 204
 
+@app.route("/ready")
+def ready():
+    # /ping — процесс жив, /ready — Sheets открыт и можно принимать трафик
+    if not sheets.is_ready():
+        sheets.warm_up()
+        return {"ready": False, "startup": startup.report()}, 503
+    return {"ready": True, "startup": startup.report()}, 200
+
+@app.route("/config/refresh", methods=["POST"])
+def refresh_config():
+    if not admin_authorized(request.headers):
+        return {"ok": False}, 403
+    if not config_cache.invalidate():
+        return {"ok": False, "config": config_cache.values()}, 503
+    # Вместимость могла вырасти — свободные места сразу получает лист ожидания
+    notify_promoted(registration_store.promote(get_current_tournament(), get_tournament_capacity()))
+    return {"ok": True, "config": config_cache.values()}, 200
+
+def start_broadcast(params):
+    # По умолчанию — описание текущего турнира всем, кто на него ещё не записан
+    text = params.get("text") or get_tournament_description()
+    if not text:
+        return {"ok": False, "error": "нет текста рассылки"}, 400
+    exclude = get_current_tournament() if params.get("exclude_registered", True) else None
+    status, error = broadcaster.create(text, exclude_tournament=exclude)
+    if error:
+        return {"ok": False, "error": error}, 409
+    return {"ok": True, "broadcast": status}, 202
+
+@app.route("/broadcast", methods=["POST"])
+def create_broadcast():
+    if not admin_authorized(request.headers):
+        return {"ok": False}, 403
+    params = request.get_json(silent=True)
+    if params is None:
+        params = {}
+    if not isinstance(params, dict):
+        return {"ok": False, "error": "ожидается JSON-объект"}, 400
+    return start_broadcast(params)
+
+@app.route("/broadcast/<int:broadcast_id>", methods=["GET"])
+def broadcast_status(broadcast_id):
+    if not admin_authorized(request.headers):
+        return {"ok": False}, 403
+    status = broadcaster.status(broadcast_id)
+    return ({"ok": True, "broadcast": status}, 200) if status else ({"ok": False}, 404)
+
+@app.route("/broadcast/<int:broadcast_id>/cancel", methods=["POST"])
+def cancel_broadcast(broadcast_id):
+    if not admin_authorized(request.headers):
+        return {"ok": False}, 403
+    status = broadcaster.cancel(broadcast_id)
+    return ({"ok": True, "broadcast": status}, 200) if status else ({"ok": False}, 404)
+
 @app.route(f"/webhook/{os.environ['TELEGRAM_BOT_TOKEN']}", methods=["POST"])
 def telegram_webhook():
     data = request.get_json()
+    # Telegram повторяет апдейт, если вебхук отвечал долго — второй раз не обрабатываем
+    with metrics.stage("dedup"):
+        duplicate = "update_id" in data and update_dedup.seen(data["update_id"], update_chat_id(data))
+    if duplicate:
+        return "", 204
+    try:
+        process_update(data)
+    except Exception:
+        # Telegram повторит апдейт после ошибки — повтор не должен отброситься как дубль
+        if "update_id" in data:
+            update_dedup.forget(data["update_id"])
+        raise
+    return "", 204
+
+def process_update(data):
     message = data.get("message")
     if not message:
-        return "", 204
+        return
 
     chat_id = message["chat"]["id"]
     text = message.get("text", "")
 
-    user_state = user_states.get(chat_id, "start")
-    user_data = user_data_confirmed.setdefault(chat_id, {})
+    with metrics.stage("state_store"):
+        user_state, user_data = state_store.get(chat_id)
+    state_started, initial_state = time.perf_counter(), user_state
 
     if text == "/start":
         description = get_tournament_description()
@@ -111,47 +214,61 @@ def telegram_webhook():
             "\n― ― ― ― ― ― ― ― ― ― ― ― ― ― ― ― ―\n"
             "📲 Для участия введите свой номер телефона без пробелов в формате 87XXXXXXXXX или +7XXXXXXXXXXX:"
         )
-        user_states[chat_id] = "wait_phone"
+        user_state = "wait_phone"
         reply = greeting
 
+    elif text == "/unregister":
+        tournament, cancelled = cancel_registration(chat_id)
+        if cancelled:
+            reply = f"❌ Ваша заявка на турнир '{tournament}' отменена."
+        else:
+            reply = f"ℹ️ У вас нет заявки на турнир '{tournament}'."
+        user_state = "done"
+
     elif user_state == "wait_phone":
         cleaned = re.sub(r"[\s\-\(\)]", "", text)
         if re.fullmatch(r"(\+7\d{10}|87\d{9})", cleaned):
             user_data["phone"] = text
-            user_states[chat_id] = "wait_name"
+            user_state = "wait_name"
             reply = "Теперь введите имя:"
         else:
             reply = "⚠️ Пожалуйста, введите корректный номер телефона в формате +7XXXXXXXXXX или 87XXXXXXXXX"
 
     elif user_state == "wait_name":
         user_data["name"] = text
-        user_states[chat_id] = "wait_surname"
+        user_state = "wait_surname"
         reply = "Отлично! Теперь введите фамилию:"
 
     elif user_state == "wait_surname":
         user_data["surname"] = text
-        user_states[chat_id] = "confirm"
+        user_state = "confirm"
         reply = f"Подтвердите регистрацию на турнир '{get_current_tournament()}'. Ответьте 1 — Да, 2 — Нет."
 
     elif user_state == "confirm":
-        if text.strip() == "1":
-            save_confirmed_user_to_file(chat_id, user_data)
-            reply = "✅ Ваша заявка принята! Спасибо!"
-        else:
+        if text.strip() != "1":
             reply = "❌ Регистрация отменена."
-        user_states[chat_id] = "done"
+        else:
+            status = save_confirmed_user_to_file(chat_id, user_data)
+            if status == CONFIRMED:
+                reply = "✅ Ваша заявка принята! Спасибо!"
+            elif status == WAITLIST:
+                reply = "📝 Все места на турнир заняты — вы в листе ожидания. Мы напишем, если место освободится."
+            else:
+                reply = f"ℹ️ Этот номер уже зарегистрирован на турнир '{get_current_tournament()}'."
+        user_state = "done"
 
     else:
         reply = "Пожалуйста, начните с команды /start"
 
-    token = os.environ['TELEGRAM_BOT_TOKEN']
-    send_url = f"https://api.telegram.org/bot{token}/sendMessage"
-    requests.post(send_url, json={
-        "chat_id": chat_id,
-        "text": reply
-    })
+    with metrics.stage("state_store"):
+        state_store.set(chat_id, user_state, user_data)
+    metrics.STATE_SECONDS.observe(time.perf_counter() - state_started, state=initial_state)
 
-    return "", 204
+    # Ответ уходит из фонового отправителя, вебхук подтверждается сразу
+    telegram_sender.send_message(chat_id, reply)
+
+sheets.warm_up()
+startup.mark("import_finished")
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+
+FAKE_SHEETS_LATENCY_MS = float(os.environ.get("FAKE_SHEETS_LATENCY_MS", 200))
+FAKE_TOURNAMENT = os.environ.get("FAKE_TOURNAMENT", "Бенчмарк")
+
+
+def _latency():
+    # Каждый вызов — как HTTP-запрос к Google: ждём заданную задержку
+    time.sleep(FAKE_SHEETS_LATENCY_MS / 1000)
+
+
+def _cell_index(label):
+    column = ord(label[0].upper()) - ord("A")
+    return int(label[1:]) - 1, column
+
+
+class FakeWorksheet:
+    """Подмножество gspread.Worksheet, которым пользуется бот, с задержкой на каждый вызов."""
+
+    def __init__(self, title, rows=None):
+        self.title = title
+        self._rows = rows or []
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _get(self, label):
+        row, column = _cell_index(label)
+        if row < len(self._rows) and column < len(self._rows[row]):
+            return self._rows[row][column]
+        return ""
+
+    def acell(self, label):
+        _latency()
+        self.calls += 1
+        return type("Cell", (), {"value": self._get(label)})()
+
+    def batch_get(self, ranges):
+        _latency()
+        self.calls += 1
+        return [[[self._get(label)]] for label in ranges]
+
+    def append_row(self, row, **kwargs):
+        self.append_rows([row], **kwargs)
+
+    def append_rows(self, rows, **kwargs):
+        _latency()
+        self.calls += 1
+        with self._lock:
+            self._rows.extend(list(row) for row in rows)
+
+    def get_all_values(self):
+        _latency()
+        self.calls += 1
+        with self._lock:
+            return [list(row) for row in self._rows]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        _latency()
+        self.sheet1 = FakeWorksheet("Лист1", [["Номер", "Имя", "Фамилия", "Турнир", "Дата", "Время"]])
+        self._worksheets = {
+            "config": FakeWorksheet("config", [
+                ["Турнир", FAKE_TOURNAMENT],
+                ["Описание", f"Турнир '{FAKE_TOURNAMENT}' для нагрузочного теста"],
+            ]),
+        }
+
+    def worksheet(self, title):
+        _latency()
+        return self._worksheets[title]
@@ -0,0 +1,95 @@
+import sys
+import json
+import time
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Приложение рвёт keep-alive соединения при остановке — это не ошибка
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeTelegram:
+    """Локальная замена Bot API: getMe, setWebhook, deleteWebhook, sendMessage.
+
+    Принимает JSON (requests в app2.py) и form-data (httpx в PTB), отвечает с
+    заданной задержкой и записывает исходящие сообщения. on_message(chat_id, text)
+    вызывается из потока сервера на каждое сообщение.
+    """
+
+    def __init__(self, latency_ms=50, on_message=None, host="127.0.0.1", port=0):
+        self.latency_ms = latency_ms
+        self.on_message = on_message
+        self.messages = 0
+        self._message_id = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                method = self.path.rsplit("/", 1)[-1]
+                self._reply(fake.handle(method, self._params(body)))
+
+            def do_GET(self):
+                self._reply(fake.handle(self.path.rsplit("/", 1)[-1], {}))
+
+            def _params(self, body):
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    return json.loads(body or b"{}")
+                return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+            def _reply(self, result):
+                data = json.dumps(result).encode()
+                self.send_response(200 if result.get("ok") else 400)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = _Server((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def handle(self, method, params):
+        time.sleep(self.latency_ms / 1000)
+        if method == "getMe":
+            return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+        if method in ("setWebhook", "deleteWebhook"):
+            return {"ok": True, "result": True}
+        if method == "sendMessage":
+            chat_id, text = int(params["chat_id"]), params.get("text", "")
+            with self._lock:
+                self.messages += 1
+                self._message_id += 1
+                message_id = self._message_id
+            if self.on_message:
+                self.on_message(chat_id, text)
+            return {"ok": True, "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }}
+        return {"ok": False, "error_code": 404, "description": f"Not Found: {method}"}
@@ -0,0 +1,238 @@
+"""Нагрузочный тест app.py / app2.py против локальных заглушек Telegram и Google Sheets.
+
+    python -m bench.loadtest --app app2 --chats 2000 --concurrency 200 \\
+        --telegram-latency-ms 50 --sheets-latency-ms 300
+
+Приложение запускается отдельным процессом в чистом временном каталоге с
+SHEETS_BACKEND=fake (bench/fake_gspread.py) и TELEGRAM_API_URL, указывающим на
+bench/fake_telegram.py. Каждый чат проходит /start → номер → имя → фамилия →
+"1", отправляя следующий шаг после ответа бота. Итог печатается одной
+JSON-строкой и дописывается в --output, чтобы сравнивать прогоны между собой.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import itertools
+import subprocess
+import tempfile
+import httpx
+from bench.fake_telegram import FakeTelegram
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "bench"
+FIRST_CHAT_ID = 10 ** 6
+
+# Лимиты отправки в Telegram по умолчанию подняты, чтобы мерить само приложение;
+# реальные лимиты можно вернуть через --env TELEGRAM_GLOBAL_RATE=30
+BENCH_ENV = {
+    "TELEGRAM_GLOBAL_RATE": "100000",
+    "TELEGRAM_CHAT_RATE": "100000",
+    "TELEGRAM_CHAT_BURST": "100000",
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(seconds):
+    if not seconds:
+        return {}
+    values = sorted(seconds)
+
+    def at(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 1)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(values[-1] * 1000, 1)}
+
+
+class ReplyWaiter:
+    """Связывает ответы заглушки Telegram (её потоки) с ожидающими корутинами чатов."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._futures = {}
+
+    def expect(self, chat_id):
+        future = self.loop.create_future()
+        self._futures[chat_id] = future
+        return future
+
+    def on_message(self, chat_id, text):
+        self.loop.call_soon_threadsafe(self._resolve, chat_id, text)
+
+    def _resolve(self, chat_id, text):
+        future = self._futures.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(text)
+
+
+def make_update(app_name, update_id, chat_id, step, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+    }
+    if step == "start":
+        message["text"] = "/start"
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+    elif step == "phone" and app_name == "app":
+        # app.py ждёт контакт с кнопки, app2.py — номер текстом
+        message["contact"] = {"phone_number": text, "first_name": "Bench", "user_id": chat_id}
+    else:
+        message["text"] = text
+    return {"update_id": update_id, "message": message}
+
+
+def start_app(args, fake_url, workdir):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        **BENCH_ENV,
+        "PYTHONPATH": REPO_DIR,
+        "FLASK_ENV": "production",
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_URL": fake_url,
+        "RENDER_EXTERNAL_URL": base_url,
+        "SHEETS_BACKEND": "fake",
+        "FAKE_SHEETS_LATENCY_MS": str(args.sheets_latency_ms),
+        # Число воркеров видят и сами воркеры: по нему app.py выбирает общий state store
+        "WEB_CONCURRENCY": str(args.workers),
+    }
+    env.update(item.split("=", 1) for item in args.env)
+    if args.app == "app":
+        command = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-c",
+                   f"import app2; app2.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    shutil.copy(os.path.join(REPO_DIR, "tournament_config.json"), workdir)
+    log = open(os.path.join(workdir, "app.log"), "w")
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, base_url
+
+
+async def wait_ready(client, base_url, process, timeout=60):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError("Приложение завершилось при старте, см. app.log")
+        try:
+            if (await client.get(f"{base_url}/ready")).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Приложение не стало готовым за отведённое время")
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    waiter = ReplyWaiter(loop)
+    fake = FakeTelegram(latency_ms=args.telegram_latency_ms, on_message=waiter.on_message).start()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    process, base_url = start_app(args, fake.url, workdir)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    client = httpx.AsyncClient(limits=limits, timeout=args.timeout)
+    try:
+        startup_seconds = await wait_ready(client, base_url, process)
+        webhook_url = f"{base_url}/webhook/{BOT_TOKEN}"
+        update_ids = itertools.count(1)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        webhook_latencies, registration_latencies = [], []
+        errors = {"http": 0, "timeout": 0, "rejected": 0}
+
+        async def conversation(chat_id):
+            steps = [("start", ""), ("phone", f"87{chat_id:09d}"[:11]), ("name", "Иван"),
+                     ("surname", f"Бенчмарков{chat_id}"), ("confirm", "1")]
+            async with semaphore:
+                started = time.perf_counter()
+                reply = ""
+                for step, text in steps:
+                    future = waiter.expect(chat_id)
+                    sent = time.perf_counter()
+                    try:
+                        response = await client.post(webhook_url, json=make_update(args.app, next(update_ids), chat_id, step, text))
+                    except httpx.HTTPError:
+                        errors["http"] += 1
+                        return
+                    webhook_latencies.append(time.perf_counter() - sent)
+                    if response.status_code != 204:
+                        errors["http"] += 1
+                        return
+                    try:
+                        reply = await asyncio.wait_for(future, args.timeout)
+                    except asyncio.TimeoutError:
+                        errors["timeout"] += 1
+                        return
+                if reply.startswith("✅"):
+                    registration_latencies.append(time.perf_counter() - started)
+                else:
+                    errors["rejected"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(conversation(FIRST_CHAT_ID + i) for i in range(args.chats)))
+        duration = time.perf_counter() - started
+    finally:
+        await client.aclose()
+        process.terminate()
+        process.wait(timeout=30)
+        fake.stop()
+        if args.keep:
+            print(f"Рабочий каталог: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "app": args.app,
+        "chats": args.chats,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "telegram_latency_ms": args.telegram_latency_ms,
+        "sheets_latency_ms": args.sheets_latency_ms,
+        "startup_ms": round(startup_seconds * 1000, 1),
+        "duration_s": round(duration, 2),
+        "registrations": len(registration_latencies),
+        "registrations_per_s": round(len(registration_latencies) / duration, 1),
+        "updates_per_s": round(len(webhook_latencies) / duration, 1),
+        "webhook_ms": percentiles(webhook_latencies),
+        "registration_ms": percentiles(registration_latencies),
+        "errors": errors,
+        "telegram_messages": fake.messages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["app", "app2"], default="app2")
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=1, help="воркеры uvicorn (только для app)")
+    parser.add_argument("--telegram-latency-ms", type=float, default=50)
+    parser.add_argument("--sheets-latency-ms", type=float, default=300)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="дополнительные переменные окружения приложения")
+    parser.add_argument("--output", help="дописать результат JSON-строкой в этот файл")
+    parser.add_argument("--keep", action="store_true", help="не удалять рабочий каталог (app.log, базы)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    line = json.dumps(result, ensure_ascii=False)
+    print(line)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os
+import hmac
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import metrics
+from storage import SqliteDatabase
+from telegram_sender import TokenBucket
+
+BROADCAST_DB_FILE = os.environ.get("BROADCAST_DB_FILE", "broadcasts.sqlite3")
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 8))
+# Запас под ответы вебхука: общий лимит бота в Telegram — около 30 сообщений в секунду
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 20))
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", 100))
+BROADCAST_STALE_AFTER = float(os.environ.get("BROADCAST_STALE_AFTER", 60))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+
+def admin_authorized(headers):
+    """Проверка заголовка X-Admin-Token. Без ADMIN_TOKEN админские запросы запрещены."""
+    token = headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+class Broadcaster:
+    """Рассылка одного сообщения всем прошлым участникам.
+
+    Получатели (уникальные chat_id из заявок) фиксируются в SQLite при создании
+    рассылки, у каждого хранится статус доставки — это и есть чекпоинт. Рассылку
+    ведёт фоновый поток одного воркера: он берёт пачку pending-получателей,
+    отправляет её пулом потоков под общим лимитом BROADCAST_RATE и лимитами
+    TelegramSender, затем одной транзакцией отмечает результаты. Владелец
+    продлевает heartbeat перед каждой пачкой и во время неё (под 429 пачка
+    может идти дольше stale_after); если процесс упал, рассылку подхватывает
+    любой воркер, заметивший устаревший heartbeat, и продолжает с
+    неотправленных. Повторно может уйти не больше одной пачки.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            owner TEXT,
+            heartbeat REAL
+        );
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (broadcast_id, chat_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, sender, registration_store, path=BROADCAST_DB_FILE, concurrency=BROADCAST_CONCURRENCY,
+                 rate=BROADCAST_RATE, batch_size=BROADCAST_BATCH_SIZE, stale_after=BROADCAST_STALE_AFTER):
+        self.sender = sender
+        self.registration_store = registration_store
+        self.db = SqliteDatabase(path, self.SCHEMA)
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self._running = set()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        """Запускает поток, подхватывающий брошенные рассылки (после падения воркера или рестарта)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._running = set()
+        threading.Thread(target=self._watch, name="broadcast-watch", daemon=True).start()
+
+    def create(self, text, exclude_tournament=None):
+        """Создаёт рассылку и запускает её. Возвращает (статус, None) или (None, ошибка)."""
+        self.start()
+        with self.db.transaction() as conn:
+            running = conn.execute("SELECT id FROM broadcasts WHERE status = 'running' LIMIT 1").fetchone()
+            if running:
+                return None, f"рассылка {running[0]} ещё идёт"
+            broadcast_id = conn.execute(
+                "INSERT INTO broadcasts (text, status, total, created_at, owner, heartbeat) VALUES (?, 'running', 0, ?, ?, ?)",
+                (text, time.time(), self.owner, time.time()),
+            ).lastrowid
+            total = 0
+            batch = []
+            for chat_id in self.registration_store.iter_chat_ids(exclude_tournament=exclude_tournament):
+                batch.append((broadcast_id, chat_id))
+                if len(batch) >= 1000:
+                    total += self._insert_recipients(conn, batch)
+            total += self._insert_recipients(conn, batch)
+            conn.execute("UPDATE broadcasts SET total = ? WHERE id = ?", (total, broadcast_id))
+        logging.info(f"📣 Рассылка {broadcast_id} создана: получателей {total}")
+        self._spawn(broadcast_id)
+        return self.status(broadcast_id), None
+
+    def cancel(self, broadcast_id):
+        self.db.execute("UPDATE broadcasts SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'running'",
+                        (time.time(), broadcast_id))
+        return self.status(broadcast_id)
+
+    def status(self, broadcast_id):
+        rows = self.db.execute("SELECT status, total, created_at, finished_at, owner FROM broadcasts WHERE id = ?",
+                               (broadcast_id,))
+        if not rows:
+            return None
+        status, total, created_at, finished_at, owner = rows[0]
+        counts = dict(self.db.execute(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status", (broadcast_id,)))
+        done = total - counts.get("pending", 0)
+        elapsed = (finished_at or time.time()) - created_at
+        return {
+            "id": broadcast_id,
+            "status": status,
+            "owner": owner,
+            "total": total,
+            "pending": counts.get("pending", 0),
+            "sent": counts.get("sent", 0),
+            "blocked": counts.get("blocked", 0),
+            "failed": counts.get("failed", 0),
+            "progress": round(done / total, 4) if total else 1.0,
+            "elapsed_s": round(elapsed, 1),
+            "rate_per_s": round(done / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+    @staticmethod
+    def _insert_recipients(conn, batch):
+        # Один чат мог регистрироваться на несколько турниров — первичный ключ отбрасывает повторы
+        before = conn.total_changes
+        conn.executemany("INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, chat_id) VALUES (?, ?)", batch)
+        inserted = conn.total_changes - before
+        batch.clear()
+        return inserted
+
+    def _claim(self, broadcast_id):
+        """Продлевает владение рассылкой; False — её отменили или подхватил другой воркер."""
+        now = time.time()
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE broadcasts SET owner = ?, heartbeat = ? "
+                "WHERE id = ? AND status = 'running' AND (owner = ? OR heartbeat < ?)",
+                (self.owner, now, broadcast_id, self.owner, now - self.stale_after),
+            )
+            return bool(cursor.rowcount)
+
+    def _spawn(self, broadcast_id):
+        with self._lock:
+            if broadcast_id in self._running:
+                return
+            self._running.add(broadcast_id)
+        threading.Thread(target=self._run, args=(broadcast_id,), name=f"broadcast-{broadcast_id}", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.stale_after / 2)
+            try:
+                rows = self.db.execute("SELECT id FROM broadcasts WHERE status = 'running' AND heartbeat < ?",
+                                       (time.time() - self.stale_after,))
+                for (broadcast_id,) in rows:
+                    logging.warning(f"⚠️ Рассылка {broadcast_id} осталась без владельца, продолжаем")
+                    self._spawn(broadcast_id)
+            except Exception as e:
+                logging.error(f"❌ Ошибка проверки рассылок: {e}")
+
+    def _run(self, broadcast_id):
+        try:
+            with ThreadPoolExecutor(self.concurrency, thread_name_prefix=f"broadcast-{broadcast_id}") as pool:
+                self._deliver(broadcast_id, pool)
+        except Exception as e:
+            logging.error(f"❌ Рассылка {broadcast_id} прервана: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(broadcast_id)
+
+    def _deliver(self, broadcast_id, pool):
+        text = self.db.execute("SELECT text FROM broadcasts WHERE id = ?", (broadcast_id,))[0][0]
+        last_chat_id = None
+        while self._claim(broadcast_id):
+            rows = self.db.execute(
+                "SELECT chat_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending' "
+                "AND (? IS NULL OR chat_id > ?) ORDER BY chat_id LIMIT ?",
+                (broadcast_id, last_chat_id, last_chat_id, self.batch_size),
+            )
+            if not rows:
+                self.db.execute("UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'",
+                                (time.time(), broadcast_id))
+                logging.info(f"✅ Рассылка {broadcast_id} завершена: {self.status(broadcast_id)}")
+                return
+            chat_ids = [chat_id for (chat_id,) in rows]
+            futures = {pool.submit(self._send, chat_id, text): chat_id for chat_id in chat_ids}
+            owned = self._wait_batch(broadcast_id, futures)
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    "UPDATE broadcast_recipients SET status = ?, error = ? WHERE broadcast_id = ? AND chat_id = ?",
+                    [(*future.result(), broadcast_id, chat_id) for future, chat_id in futures.items()
+                     if not future.cancelled()],
+                )
+            if not owned:
+                break
+            last_chat_id = chat_ids[-1]
+        logging.info(f"⏹️ Рассылка {broadcast_id} остановлена в этом воркере")
+
+    def _wait_batch(self, broadcast_id, futures):
+        """Ждёт отправки пачки, продлевая heartbeat. False — владение потеряно, неначатые отправки отменены."""
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=self.stale_after / 3)
+            if pending and not self._claim(broadcast_id):
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                return False
+        return True
+
+    def _send(self, chat_id, text):
+        self.bucket.acquire()
+        try:
+            result = self.sender.call("sendMessage", {"chat_id": chat_id, "text": text})
+        except Exception as e:
+            result = {"ok": False, "description": str(e)}
+        if result.get("ok"):
+            status, error = "sent", None
+        elif result.get("error_code") == 403:
+            status, error = "blocked", result.get("description")  # бот заблокирован пользователем
+        else:
+            status, error = "failed", result.get("description")
+        metrics.BROADCAST_MESSAGES.inc(result=status)
+        return status, error
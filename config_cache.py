@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import logging
+import threading
+import metrics
+
+CONFIG_FALLBACK_FILE = "tournament_config.json"
+CONFIG_CACHE_TTL = float(os.environ.get("CONFIG_CACHE_TTL", 60))
+CONFIG_RETRY_DELAY = float(os.environ.get("CONFIG_RETRY_DELAY", 10))
+CONFIG_LOAD_TIMEOUT = float(os.environ.get("CONFIG_LOAD_TIMEOUT", 3))
+
+# 🔽 Ключи конфигурации и ячейки листа "config", из которых они читаются
+CONFIG_CELLS = {
+    "current_tournament": "B1",
+    "tournament_description": "B2",
+    "tournament_capacity": "B3",  # число мест; пусто или 0 — без ограничения
+}
+
+
+class TournamentConfigCache:
+    """Кэш листа "config": одно пакетное чтение, TTL и фоновое обновление.
+
+    Значения отдаются из памяти. Когда TTL истёк, запрос получает старое
+    значение, а перечитывание идёт в фоне. Если Sheets недоступен, используется
+    последний удачный снимок из tournament_config.json.
+    """
+
+    def __init__(self, get_worksheet, ttl=CONFIG_CACHE_TTL, fallback_file=CONFIG_FALLBACK_FILE, cells=None):
+        self._get_worksheet = get_worksheet
+        self.ttl = ttl
+        self.fallback_file = fallback_file
+        self.cells = dict(cells or CONFIG_CELLS)
+        self._values = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get(self, key, default=""):
+        if self._values is None:
+            self._initial_load()
+        elif time.monotonic() >= self._expires_at:
+            self._refresh_in_background()
+        return (self._values or {}).get(key, default)
+
+    def values(self):
+        self.get(next(iter(self.cells)))
+        return dict(self._values or {})
+
+    def invalidate(self):
+        """Сбрасывает кэш и сразу перечитывает лист. Возвращает True при успехе."""
+        self._expires_at = 0.0
+        return self.refresh()
+
+    def refresh(self):
+        try:
+            values = self._load_from_sheets()
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения конфигурации из Sheets: {e}")
+            with self._lock:
+                if self._values is None:
+                    self._values = self._load_fallback()
+                self._expires_at = time.monotonic() + CONFIG_RETRY_DELAY
+            return False
+
+        with self._lock:
+            self._values = values
+            self._expires_at = time.monotonic() + self.ttl
+        self._save_fallback(values)
+        return True
+
+    def _initial_load(self):
+        # Первое обращение ждёт Sheets не дольше CONFIG_LOAD_TIMEOUT,
+        # дальше отдаём снимок из файла, а загрузка продолжается в фоне
+        thread = self._refresh_in_background()
+        if thread is not None:
+            thread.join(CONFIG_LOAD_TIMEOUT)
+        with self._lock:
+            if self._values is None:
+                logging.warning("⚠️ Sheets не ответил вовремя, используем tournament_config.json")
+                self._values = self._load_fallback()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return self._refresh_thread
+            self._refresh_thread = threading.Thread(target=self.refresh, name="config-refresh", daemon=True)
+            self._refresh_thread.start()
+            return self._refresh_thread
+
+    def _load_from_sheets(self):
+        keys = list(self.cells)
+        with metrics.stage("sheets_config_read"):
+            ranges = self._get_worksheet().batch_get([self.cells[key] for key in keys])
+        values = {}
+        for key, value_range in zip(keys, ranges):
+            cell = value_range[0][0] if value_range and value_range[0] else ""
+            values[key] = str(cell).strip()
+        return values
+
+    def _load_fallback(self):
+        try:
+            with open(self.fallback_file, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"❌ Не удалось прочитать {self.fallback_file}: {e}")
+            return {}
+        return {key: str(data.get(key, "")).strip() for key in self.cells}
+
+    def _save_fallback(self, values):
+        tmp_file = f"{self.fallback_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(values, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.fallback_file)
+        except OSError as e:
+            logging.error(f"❌ Не удалось сохранить {self.fallback_file}: {e}")
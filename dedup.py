@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from storage import SqliteDatabase
+
+DEDUP_BACKEND = os.environ.get("DEDUP_BACKEND", "memory")
+DEDUP_DB_FILE = os.environ.get("DEDUP_DB_FILE", "bot_state.sqlite3")
+DEDUP_WINDOW = float(os.environ.get("DEDUP_WINDOW", 60 * 60))
+DEDUP_MAX_UPDATES = int(os.environ.get("DEDUP_MAX_UPDATES", 100000))
+
+
+class MemoryUpdateDeduplicator:
+    """Окно последних update_id в памяти процесса: O(1) на апдейт, размер ограничен."""
+
+    def __init__(self, window=DEDUP_WINDOW, max_updates=DEDUP_MAX_UPDATES):
+        self.window = window
+        self.max_updates = max_updates
+        self._seen = OrderedDict()  # update_id -> время получения
+        self._last_by_chat = OrderedDict()  # chat_id -> (последний update_id, время)
+        self._lock = threading.Lock()
+
+    def seen(self, update_id, chat_id=None):
+        """True, если апдейт уже обрабатывался или пришёл позже более нового апдейта того же чата."""
+        now = time.monotonic()
+        with self._lock:
+            if update_id in self._seen:
+                logging.info(f"🔁 Повторная доставка апдейта {update_id}, пропускаем")
+                return True
+            self._seen[update_id] = now
+            self._evict(self._seen, now, lambda seen_at: seen_at)
+
+            if chat_id is not None:
+                last = self._last_by_chat.get(chat_id)
+                if last is not None and last[0] > update_id:
+                    logging.info(f"🔁 Апдейт {update_id} старше уже обработанного {last[0]} в чате {chat_id}, пропускаем")
+                    return True
+                self._last_by_chat[chat_id] = (update_id, now)
+                self._last_by_chat.move_to_end(chat_id)
+                self._evict(self._last_by_chat, now, lambda last: last[1])
+            return False
+
+    def _evict(self, records, now, seen_at):
+        # Записи упорядочены по времени: удаляем с начала, пока они вне окна или их слишком много
+        while records:
+            if len(records) <= self.max_updates and now - seen_at(next(iter(records.values()))) <= self.window:
+                break
+            records.popitem(last=False)
+
+    def forget(self, update_id):
+        """Снимает отметку: апдейт не обработан, повтор от Telegram должен пройти."""
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+
+class SqliteUpdateDeduplicator:
+    """То же окно в SQLite — общее для всех воркеров."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            seen_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS processed_updates_seen ON processed_updates (seen_at);
+        CREATE TABLE IF NOT EXISTS chat_last_update (
+            chat_id INTEGER PRIMARY KEY,
+            update_id INTEGER NOT NULL,
+            seen_at REAL NOT NULL
+        );
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path=DEDUP_DB_FILE, window=DEDUP_WINDOW):
+        self.window = window
+        self.db = SqliteDatabase(path, self.SCHEMA)
+        self._checks = 0
+
+    def seen(self, update_id, chat_id=None):
+        now = time.time()
+        with self.db.transaction() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO processed_updates (update_id, seen_at) VALUES (?, ?)",
+                                  (update_id, now))
+            if not cursor.rowcount:
+                logging.info(f"🔁 Повторная доставка апдейта {update_id}, пропускаем")
+                return True
+            if chat_id is not None:
+                row = conn.execute("SELECT update_id FROM chat_last_update WHERE chat_id = ?", (chat_id,)).fetchone()
+                if row and row[0] > update_id:
+                    logging.info(f"🔁 Апдейт {update_id} старше уже обработанного {row[0]} в чате {chat_id}, пропускаем")
+                    return True
+                conn.execute("INSERT OR REPLACE INTO chat_last_update (chat_id, update_id, seen_at) VALUES (?, ?, ?)",
+                             (chat_id, update_id, now))
+        self._checks += 1
+        if self._checks % self.PRUNE_EVERY == 0:
+            self.prune()
+        return False
+
+    def forget(self, update_id):
+        """Снимает отметку: апдейт не обработан, повтор от Telegram должен пройти."""
+        self.db.execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+
+    def prune(self):
+        cutoff = time.time() - self.window
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM processed_updates WHERE seen_at < ?", (cutoff,))
+            conn.execute("DELETE FROM chat_last_update WHERE seen_at < ?", (cutoff,))
+
+
+def create_update_deduplicator():
+    if DEDUP_BACKEND == "sqlite":
+        return SqliteUpdateDeduplicator()
+    return MemoryUpdateDeduplicator()
+
+
+def update_chat_id(data):
+    """chat_id из сырого апдейта Telegram (message, edited_message, callback_query...)."""
+    for key in ("message", "edited_message", "callback_query"):
+        payload = data.get(key)
+        if payload:
+            chat = (payload.get("message") or payload).get("chat") or {}
+            return chat.get("id")
+    return None
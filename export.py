@@ -0,0 +1,154 @@
+import io
+import csv
+import json
+import zlib
+import hashlib
+import tempfile
+from datetime import date
+from email.utils import formatdate, parsedate_to_datetime
+from registration_store import CSV_HEADER, CONFIRMED, WAITLIST
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+EXPORT_CHUNK_ROWS = 200
+JSON_KEYS = ["phone", "name", "surname", "tournament", "date", "time"]
+
+
+def parse_export_args(args):
+    """Фильтры и формат из query string: ?tournament=&status=confirmed|waitlist&from=YYYY-MM-DD&to=YYYY-MM-DD&format=csv|json|xlsx"""
+    fmt = args.get("format", "csv").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    if fmt == "xlsx" and openpyxl is None:
+        raise ValueError("Формат xlsx недоступен: не установлен openpyxl")
+    filters = {"tournament": args.get("tournament") or None, "status": args.get("status") or CONFIRMED}
+    if filters["status"] not in (CONFIRMED, WAITLIST):
+        raise ValueError(f"Неизвестный статус заявки: {filters['status']}")
+    for arg, key in (("from", "date_from"), ("to", "date_to")):
+        value = args.get(arg) or None
+        if value:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Дата '{value}' должна быть в формате YYYY-MM-DD")
+        filters[key] = value
+    return fmt, filters
+
+
+def prepare_export(store, args, request_headers):
+    """Готовит ответ /export: (status, headers, body), где body — итератор байтов.
+
+    Не зависит от веб-фреймворка: Flask и ASGI-приложение лишь оборачивают
+    результат в свой Response.
+    """
+    try:
+        fmt, filters = parse_export_args(args)
+    except ValueError as e:
+        return 400, {"Content-Type": "text/plain; charset=utf-8"}, [str(e).encode()]
+    if not store.has_rows():
+        return 200, {"Content-Type": "text/plain; charset=utf-8"}, ["Нет данных для выгрузки".encode()]
+
+    use_gzip = fmt != "xlsx" and "gzip" in request_headers.get("Accept-Encoding", "")
+    version, modified_at = store.version()
+    key = json.dumps([version, fmt, use_gzip, filters], sort_keys=True)
+    etag = f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(int(modified_at), usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+
+    if _not_modified(request_headers, etag, int(modified_at)):
+        return 304, headers, []
+
+    headers["Content-Type"] = EXPORT_FORMATS[fmt]
+    headers["Content-Disposition"] = f'attachment; filename="users.{fmt}"'
+    rows = store.iter_rows(**filters)
+    body = {"csv": iter_csv, "json": iter_json, "xlsx": iter_xlsx}[fmt](rows)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        body = gzip_chunks(body)
+    return 200, headers, body
+
+
+def _not_modified(request_headers, etag, modified_at):
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request_headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= modified_at
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _batched(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_CHUNK_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for batch in _batched(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_json(rows):
+    yield b"["
+    first = True
+    for batch in _batched(rows):
+        parts = [json.dumps(dict(zip(JSON_KEYS, row)), ensure_ascii=False) for row in batch]
+        chunk = ",".join(parts)
+        yield (chunk if first else "," + chunk).encode("utf-8")
+        first = False
+    yield b"]"
+
+
+def iter_xlsx(rows):
+    # write_only не держит лист в памяти; zip-архив собирается во временном файле
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet("users")
+    worksheet.append(CSV_HEADER)
+    for row in rows:
+        worksheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                return
+            yield chunk
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
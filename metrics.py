@@ -0,0 +1,188 @@
+import os
+import time
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 0))  # 0 — лог медленных запросов выключен
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.extend(self._render_value(dict(labels), value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return [f"{self.name}{_format_labels(labels)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Значение снимается в момент выдачи /metrics через функцию (например, длина очереди)."""
+
+    kind = "gauge"
+
+    def set_function(self, func, **labels):
+        with self._lock:
+            self._values[tuple(labels.items())] = func
+
+    def _render_value(self, labels, func):
+        try:
+            value = func()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels(labels)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0, 0.0]  # бакеты, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    def _render_value(self, labels, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {counts[-2]}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-2]}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("bot_request_seconds", "Время обработки HTTP-запроса или апдейта")
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Время отдельных этапов обработки")
+STATE_SECONDS = Histogram("bot_state_seconds", "Время обработки сообщения по состоянию разговора")
+ERRORS = Counter("bot_errors_total", "Ошибки обращений к внешним сервисам")
+QUEUE_DEPTH = Gauge("bot_queue_depth", "Длина внутренних очередей")
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Сообщения рассылок по результату доставки")
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Начало и этапы текущего запроса — для разбивки в логе медленных запросов
+_request_started = contextvars.ContextVar("request_started", default=None)
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Замеряет этап (чтение Sheets, запись в хранилище, вызов Telegram...)."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(component=name, reason="exception")
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, elapsed))
+
+
+def timed_state(state):
+    """Декоратор async-обработчика PTB: время обработки сообщения в состоянии state."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                STATE_SECONDS.observe(time.perf_counter() - started, state=state)
+        return wrapper
+    return decorator
+
+
+def start_request():
+    _request_started.set(time.perf_counter())
+    _request_stages.set([])
+
+
+def finish_request(route):
+    started = _request_started.get()
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    REQUEST_SECONDS.observe(elapsed, route=route)
+    stages = _request_stages.get() or []
+    _request_started.set(None)
+    _request_stages.set(None)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ", ".join(f"{name}={seconds * 1000:.1f}" for name, seconds in stages) or "—"
+        logging.warning(f"🐢 Медленный запрос {route}: {elapsed * 1000:.1f} мс ({breakdown})")
+
+
+class MetricsMiddleware:
+    """ASGI-обёртка: время каждого HTTP-запроса по имени обработчика маршрута."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start_request()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            endpoint = scope.get("endpoint")
+            finish_request(getattr(endpoint, "__name__", "not_found"))
@@ -0,0 +1,218 @@
+import os
+import time
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import BasePersistence, BaseUpdateProcessor, PersistenceInput, TypeHandler
+
+PTB_PERSISTENCE_INTERVAL = 5
+RELEASE_GROUP = 100  # после всех групп обработчиков app.py
+CHAT_LOCK_TIMEOUT = float(os.environ.get("CHAT_LOCK_TIMEOUT", 10))
+
+
+class StateStorePersistence(BasePersistence):
+    """Persistence для ConversationHandler из app.py поверх state_store.
+
+    Бот работает только в личных чатах, поэтому chat_id совпадает с user_id:
+    ключ разговора (chat_id, user_id) и user_data хранятся в одной записи.
+    Единственная копия данных чата — в store: store_conversations загружает
+    её перед каждым апдейтом и после него убирает из памяти PTB. Поэтому при
+    старте ничего не загружается, а user_data/chat_data, которые PTB сбрасывает
+    или сохраняет сам, сюда не пишутся — только состояние разговора.
+    """
+
+    def __init__(self, store, update_interval=PTB_PERSISTENCE_INTERVAL):
+        # user_data и chat_data включены, чтобы PTB очищал свои списки чатов к
+        # сохранению/удалению: при выключенных они копятся без ограничения
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+
+    # Обращения к store (SQLite) блокирующие — выполняем их вне event loop
+
+    async def get_chat(self, chat_id):
+        """(состояние разговора, user_data) одного чата — для store_conversations."""
+        return await asyncio.to_thread(self.store.get, chat_id, None)
+
+    async def write_user_data(self, user_id, data):
+        """Записывает user_data, не трогая сохранённое состояние разговора."""
+        def update():
+            state, _ = self.store.get(user_id, default_state=None)
+            self.store.set(user_id, state, data)
+        await asyncio.to_thread(update)
+
+    async def update_conversation(self, name, key, new_state):
+        def update():
+            state, data = self.store.get(key[0], default_state=None)
+            self.store.set(key[0], new_state, data)
+        await asyncio.to_thread(update)
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def get_user_data(self):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        # Запись в store живёт по его TTL/LRU, сброс копии PTB её не удаляет
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+async def lock_chat(chat_locks, chat_id, timeout=CHAT_LOCK_TIMEOUT):
+    """Ждёт межпроцессную блокировку чата на event loop. False — не дождались за timeout."""
+    deadline = time.monotonic() + timeout
+    delay = 0.005
+    while not chat_locks.try_acquire(chat_id):
+        if time.monotonic() >= deadline:
+            logging.warning(f"⚠️ Чат {chat_id} занят другим воркером дольше {timeout} с, обрабатываем без блокировки")
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.1)
+    return True
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Разные чаты обрабатываются параллельно, апдейты одного чата — строго по очереди.
+
+    Иначе следующий ответ пользователя может прийти раньше, чем ConversationHandler
+    сохранит новое состояние, и попадёт в обработчик старого шага.
+
+    Своей очереди апдейт ждёт до того, как займёт один из max_concurrent_updates
+    слотов: иначе несколько апдейтов одного чата, ждущие друг друга, заняли бы
+    все слоты и остановили остальные чаты. С chat_locks (несколько воркеров)
+    так же, до слота, берётся межпроцессная блокировка чата — на всё время апдейта.
+    """
+
+    def __init__(self, max_concurrent_updates, chat_locks=None):
+        super().__init__(max_concurrent_updates)
+        self.chat_locks = chat_locks
+        self._queues = {}
+
+    async def process_update(self, update, coroutine):
+        chat_id = update.effective_chat.id if isinstance(update, Update) and update.effective_chat else None
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+            return
+        # chat_id -> [замок, сколько апдейтов его ждут]; запись удаляется за последним
+        entry = self._queues.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                locked = self.chat_locks is not None and await lock_chat(self.chat_locks, chat_id)
+                try:
+                    await super().process_update(update, coroutine)
+                finally:
+                    if locked:
+                        self.chat_locks.release(chat_id)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._queues[chat_id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def _restore_conversation(conv_handler, key, state):
+    # У ConversationHandler нет публичного способа подставить или убрать
+    # состояние одного разговора: persistence.get_conversations он читает только
+    # при старте. Поэтому здесь, и только здесь, используется его внутренний
+    # TrackingDict (без отметки о записи, чтобы PTB не сохранял это обратно) —
+    # это завязано на python-telegram-bot 20.7 (см. requirements.txt; поломку
+    # при обновлении PTB ловит tests/test_ptb_persistence.py)
+    if state is None:
+        conv_handler._conversations.data.pop(key, None)
+    else:
+        conv_handler._conversations.update_no_track({key: state})
+
+
+def store_conversations(application, conv_handler):
+    """Держит состояние ConversationHandler и user_data только в store.
+
+    Перед обработкой апдейта состояние и user_data чата читаются из store,
+    после — сразу сохраняются, а копии в памяти PTB убираются. Так память
+    процесса ограничена TTL/LRU store, а не числом всех чатов, и при общем
+    SQLite несколько воркеров продолжают разговоры друг друга.
+
+    Ответ пользователю уходит раньше сохранения, поэтому при нескольких
+    воркерах чат всё это время заблокирован между процессами
+    (PerChatUpdateProcessor с chat_locks): иначе следующее сообщение могло бы
+    попасть в другой воркер со старым состоянием. По той же причине user_data
+    пишется сразу за состоянием, а не когда PTB соберётся сохранить его сам.
+    """
+    persistence = application.persistence
+
+    async def load_conversation(update, context):
+        if update.effective_chat is None or update.effective_user is None:
+            return
+        key = (update.effective_chat.id, update.effective_user.id)
+        state, data = await persistence.get_chat(key[0])
+        context.user_data.clear()
+        context.user_data.update(data)
+        _restore_conversation(conv_handler, key, state)
+
+    async def save_conversation(update, context):
+        if update.effective_chat is None or update.effective_user is None:
+            return
+        # Новое состояние разговора PTB записывает через persistence.update_conversation
+        await context.application.update_persistence()
+        await persistence.write_user_data(update.effective_chat.id, dict(context.user_data))
+
+    async def release_conversation(update, context):
+        # Последней группой: PTB помечает чат к сохранению сразу после неё, без
+        # await между ними, поэтому пометка и сброс попадают в одно сохранение
+        # и сброшенные данные не создаются заново
+        if update.effective_chat is not None:
+            context.application.drop_chat_data(update.effective_chat.id)
+        if update.effective_user is not None:
+            context.application.drop_user_data(update.effective_user.id)
+        if update.effective_chat is not None and update.effective_user is not None:
+            _restore_conversation(conv_handler, (update.effective_chat.id, update.effective_user.id), None)
+
+    application.add_handler(TypeHandler(Update, load_conversation), group=-1)
+    application.add_handler(TypeHandler(Update, save_conversation), group=1)
+    application.add_handler(TypeHandler(Update, release_conversation), group=RELEASE_GROUP)
@@ -0,0 +1,349 @@
+import os
+import re
+import csv
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+import metrics
+from storage import SqliteDatabase
+
+REGISTRATIONS_DB_FILE = os.environ.get("REGISTRATIONS_DB_FILE", "registrations.sqlite3")
+CSV_HEADER = ["Номер", "Имя", "Фамилия", "Турнир", "Дата", "Время"]
+CONFIRMED, WAITLIST = "confirmed", "waitlist"
+CSV_REBUILD_RETRY = float(os.environ.get("CSV_REBUILD_RETRY", 1))
+
+
+def normalize_phone(phone):
+    # 8 705 123-45-67, +77051234567 и 87051234567 — один и тот же номер
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    return digits
+
+
+class RegistrationStore:
+    """Заявки в SQLite с уникальным индексом по (нормализованный номер, турнир).
+
+    Проверка дубля — один поиск по индексу. Запись идёт в транзакции, поэтому
+    несколько воркеров могут подтверждать заявки одновременно. confirmed_users.csv
+    поддерживается как представление подтверждённых заявок для обратной
+    совместимости: новая заявка дописывается в него под flock. После отмены
+    файл пересобирается из базы в фоновом потоке (см. _rebuild_csv).
+
+    Занятые места турнира хранятся счётчиком в таблице seats: он заполняется
+    одним COUNT при первой заявке на турнир и дальше меняется в той же
+    транзакции, что и заявка. Сверх вместимости заявка попадает в лист
+    ожидания, освободившиеся места отдаются ему по порядку заявок.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_norm TEXT NOT NULL,
+            tournament TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            name TEXT NOT NULL,
+            surname TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            chat_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'confirmed',
+            confirmed_version INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (phone_norm, tournament)
+        );
+        CREATE INDEX IF NOT EXISTS registrations_tournament ON registrations (tournament, date);
+        CREATE INDEX IF NOT EXISTS registrations_date ON registrations (date);
+        CREATE INDEX IF NOT EXISTS registrations_chat ON registrations (chat_id);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS seats (tournament TEXT PRIMARY KEY, confirmed INTEGER NOT NULL);
+    """
+
+    def __init__(self, csv_file, path=REGISTRATIONS_DB_FILE):
+        self.csv_file = csv_file
+        self.db = SqliteDatabase(path, self.SCHEMA)
+        self._rebuild_requested = False
+        self._rebuild_thread = None
+        self._rebuild_lock = threading.Lock()
+        self._migrate()
+        self._import_csv()
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'csv_dirty'"):
+            self._schedule_csv_rebuild()  # процесс упал, не успев пересобрать CSV после отмены
+
+    def add(self, row, chat_id=None, capacity=0):
+        """Сохраняет заявку (строку в порядке CSV_HEADER) с учётом вместимости турнира (0 — без ограничения).
+
+        Возвращает (статус, переведённые) — статус CONFIRMED или WAITLIST, None,
+        если номер уже зарегистрирован на турнир; переведённые — заявки
+        [(строка, chat_id)], получившие место из листа ожидания.
+        """
+        phone, name, surname, tournament, date_str, time_str = row
+        with self._locked_csv() as f:
+            with metrics.stage("registration_db"), self.db.transaction() as conn:
+                if conn.execute("SELECT 1 FROM registrations WHERE phone_norm = ? AND tournament = ?",
+                                (normalize_phone(phone), tournament)).fetchone():
+                    return None, []
+                version = self._next_version(conn)
+                # Свободное место сначала получает лист ожидания, а не новая заявка
+                promoted = self._promote(conn, tournament, capacity, version)
+                status = CONFIRMED if self._has_seat(conn, tournament, capacity) else WAITLIST
+                conn.execute(
+                    "INSERT INTO registrations (phone_norm, tournament, phone, name, surname, date, time, chat_id, "
+                    "status, confirmed_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (normalize_phone(phone), tournament, phone, name, surname, date_str, time_str, chat_id,
+                     status, version if status == CONFIRMED else 0),
+                )
+                if status == CONFIRMED:
+                    conn.execute("UPDATE seats SET confirmed = confirmed + 1 WHERE tournament = ?", (tournament,))
+                self._bump_version(conn)
+            self._write_csv(f, [promoted_row for promoted_row, _ in promoted] + ([row] if status == CONFIRMED else []))
+        return status, promoted
+
+    def cancel(self, chat_id, tournament, capacity=0):
+        """Отменяет заявки чата на турнир. Возвращает ([(строка, статус)], переведённые из листа ожидания)."""
+        with self._locked_csv() as f:
+            with metrics.stage("registration_db"), self.db.transaction() as conn:
+                rows = conn.execute(
+                    "SELECT phone, name, surname, tournament, date, time, status FROM registrations "
+                    "WHERE chat_id = ? AND tournament = ?", (chat_id, tournament)).fetchall()
+                if not rows:
+                    return [], []
+                freed = sum(1 for row in rows if row[-1] == CONFIRMED)
+                if freed:
+                    self._seats(conn, tournament)  # заполнить счётчик до удаления, если турнир ещё не считали
+                    conn.execute("UPDATE seats SET confirmed = confirmed - ? WHERE tournament = ?", (freed, tournament))
+                conn.execute("DELETE FROM registrations WHERE chat_id = ? AND tournament = ?", (chat_id, tournament))
+                version = self._next_version(conn)
+                promoted = self._promote(conn, tournament, capacity, version)
+                if freed:
+                    # Строку из середины CSV не удалить — файл пересоберёт фоновый поток
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_dirty', ?)", (str(version),))
+                self._bump_version(conn)
+            self._write_csv(f, [promoted_row for promoted_row, _ in promoted])
+        if freed:
+            self._schedule_csv_rebuild()
+        return [(list(row[:-1]), row[-1]) for row in rows], promoted
+
+    def promote(self, tournament, capacity=0):
+        """Отдаёт свободные места листу ожидания (например, после увеличения вместимости)."""
+        with self._locked_csv() as f:
+            with metrics.stage("registration_db"), self.db.transaction() as conn:
+                promoted = self._promote(conn, tournament, capacity, self._next_version(conn))
+                if promoted:
+                    self._bump_version(conn)
+            self._write_csv(f, [promoted_row for promoted_row, _ in promoted])
+        return promoted
+
+    def _seats(self, conn, tournament):
+        row = conn.execute("SELECT confirmed FROM seats WHERE tournament = ?", (tournament,)).fetchone()
+        if row is not None:
+            return row[0]
+        # Первая заявка на турнир после запуска счётчика: считаем уже подтверждённые один раз
+        confirmed = conn.execute("SELECT COUNT(*) FROM registrations WHERE tournament = ? AND status = ?",
+                                 (tournament, CONFIRMED)).fetchone()[0]
+        conn.execute("INSERT INTO seats (tournament, confirmed) VALUES (?, ?)", (tournament, confirmed))
+        return confirmed
+
+    def _has_seat(self, conn, tournament, capacity):
+        return capacity <= 0 or self._seats(conn, tournament) < capacity
+
+    def _promote(self, conn, tournament, capacity, version):
+        promoted = []
+        while self._has_seat(conn, tournament, capacity):
+            row = conn.execute(
+                "SELECT id, phone, name, surname, tournament, date, time, chat_id FROM registrations "
+                "WHERE tournament = ? AND status = ? ORDER BY id LIMIT 1", (tournament, WAITLIST)).fetchone()
+            if row is None:
+                break
+            conn.execute("UPDATE registrations SET status = ?, confirmed_version = ? WHERE id = ?",
+                         (CONFIRMED, version, row[0]))
+            conn.execute("UPDATE seats SET confirmed = confirmed + 1 WHERE tournament = ?", (tournament,))
+            promoted.append((list(row[1:7]), row[7]))
+        if promoted:
+            logging.info(f"🎟️ Из листа ожидания турнира '{tournament}' переведено: {len(promoted)}")
+        return promoted
+
+    def iter_rows(self, tournament=None, date_from=None, date_to=None, status=CONFIRMED, batch_size=500):
+        """Строки заявок в порядке CSV_HEADER. Читает пачками по id, память не растёт с объёмом."""
+        conditions, params = ["id > ?", "status = ?"], [status]
+        if tournament:
+            conditions.append("tournament = ?")
+            params.append(tournament)
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date <= ?")
+            params.append(date_to)
+        sql = (f"SELECT id, phone, name, surname, tournament, date, time FROM registrations "
+               f"WHERE {' AND '.join(conditions)} ORDER BY id LIMIT {int(batch_size)}")
+        last_id = 0
+        while True:
+            rows = self.db.execute(sql, (last_id, *params))
+            for row in rows:
+                yield list(row[1:])
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def iter_chat_ids(self, exclude_tournament=None, batch_size=1000):
+        """Уникальные chat_id участников (заявки, импортированные из CSV, chat_id не содержат)."""
+        sql = "SELECT DISTINCT chat_id FROM registrations WHERE chat_id > ?"
+        params = []
+        if exclude_tournament:
+            sql += " AND chat_id NOT IN (SELECT chat_id FROM registrations WHERE tournament = ? AND chat_id IS NOT NULL)"
+            params.append(exclude_tournament)
+        sql += f" ORDER BY chat_id LIMIT {int(batch_size)}"
+        last_chat_id = -(1 << 63)
+        while True:
+            rows = self.db.execute(sql, (last_chat_id, *params))
+            for (chat_id,) in rows:
+                yield chat_id
+            if len(rows) < batch_size:
+                return
+            last_chat_id = rows[-1][0]
+
+    def has_rows(self):
+        return bool(self.db.execute("SELECT 1 FROM registrations LIMIT 1"))
+
+    def version(self):
+        """(номер версии, время последнего изменения) — меняется при каждой записи."""
+        rows = dict(self.db.execute("SELECT key, value FROM meta WHERE key IN ('version', 'modified_at')"))
+        return int(rows.get("version", 0)), float(rows.get("modified_at", 0))
+
+    @staticmethod
+    def _next_version(conn):
+        # Версия, которую транзакция получит в _bump_version: ею помечаются подтверждённые заявки
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) + 1 if row else 1
+
+    @staticmethod
+    def _bump_version(conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('version', '1') "
+                     "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('modified_at', ?)", (str(time.time()),))
+
+    @contextmanager
+    def _csv_lock(self):
+        # Отдельный файл блокировки: при пересборке сам CSV подменяется через os.replace
+        with open(f"{self.csv_file}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked_csv(self):
+        # Блокировка берётся до транзакции: CSV меняется в том же порядке, что и база
+        with self._csv_lock(), open(self.csv_file, "a", newline="", encoding="utf-8") as f:
+            yield f
+
+    @staticmethod
+    def _write_csv(f, rows):
+        if not rows:
+            return
+        with metrics.stage("csv_append"):
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(CSV_HEADER)
+            writer.writerows(rows)
+            f.flush()
+
+    def _iter_confirmed(self, min_version, max_version, batch_size=500):
+        # Подтверждённые заявки с confirmed_version в (min_version, max_version], пачками по id
+        sql = ("SELECT id, phone, name, surname, tournament, date, time FROM registrations "
+               "WHERE id > ? AND status = ? AND confirmed_version > ? AND confirmed_version <= ? "
+               f"ORDER BY id LIMIT {int(batch_size)}")
+        last_id = 0
+        while True:
+            rows = self.db.execute(sql, (last_id, CONFIRMED, min_version, max_version))
+            for row in rows:
+                yield list(row[1:])
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def _schedule_csv_rebuild(self):
+        with self._rebuild_lock:
+            self._rebuild_requested = True
+            if self._rebuild_thread is None:
+                self._rebuild_thread = threading.Thread(target=self._rebuild_csv_loop, name="csv-rebuild", daemon=True)
+                self._rebuild_thread.start()
+
+    def _rebuild_csv_loop(self):
+        while True:
+            with self._rebuild_lock:
+                if not self._rebuild_requested:
+                    self._rebuild_thread = None
+                    return
+                self._rebuild_requested = False
+            while True:
+                try:
+                    if self._rebuild_csv():
+                        break
+                except Exception as e:
+                    logging.error(f"❌ Ошибка пересборки {self.csv_file}: {e}")
+                time.sleep(CSV_REBUILD_RETRY)
+
+    def _rebuild_csv(self):
+        """Пересобирает CSV из базы, не задерживая подтверждения заявок.
+
+        Основная часть пишется во временный файл без блокировки — заявки,
+        подтверждённые до снимка версии. Под блокировкой дописываются только
+        подтверждённые за время пересборки, и файл подменяется. Если за это время
+        была новая отмена, попытка повторяется. True — CSV актуален.
+        """
+        snapshot = self.version()[0]
+        tmp_file = f"{self.csv_file}.{os.getpid()}.tmp"
+        with metrics.stage("csv_rebuild"), open(tmp_file, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(self._iter_confirmed(-1, snapshot))
+            with self._csv_lock():
+                dirty = self.db.execute("SELECT value FROM meta WHERE key = 'csv_dirty'")
+                if dirty and int(dirty[0][0]) > snapshot:
+                    os.remove(tmp_file)
+                    return False
+                writer.writerows(self._iter_confirmed(snapshot, 1 << 62))
+                f.flush()
+                os.fsync(f.fileno())
+                os.replace(tmp_file, self.csv_file)
+                self.db.execute("DELETE FROM meta WHERE key = 'csv_dirty'")
+        logging.info(f"📄 {self.csv_file} пересобран после отмены заявок")
+        return True
+
+    def _migrate(self):
+        # База, созданная до появления вместимости турниров: все заявки считаются подтверждёнными.
+        # Воркеры стартуют одновременно — колонку проверяем уже под блокировкой записи
+        with self.db.transaction() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(registrations)")]
+            if "status" not in columns:
+                conn.execute(f"ALTER TABLE registrations ADD COLUMN status TEXT NOT NULL DEFAULT '{CONFIRMED}'")
+            if "confirmed_version" not in columns:
+                conn.execute("ALTER TABLE registrations ADD COLUMN confirmed_version INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS registrations_status ON registrations (tournament, status, id)")
+
+    def _import_csv(self):
+        # Одноразовый перенос старых заявок из CSV; дубли отбрасываются индексом
+        with self.db.transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+                return
+            imported = 0
+            if os.path.exists(self.csv_file):
+                with open(self.csv_file, newline="", encoding="utf-8") as f:
+                    for row in csv.reader(f):
+                        if len(row) != len(CSV_HEADER) or row == CSV_HEADER:
+                            continue
+                        phone, name, surname, tournament, date_str, time_str = row
+                        conn.execute(
+                            "INSERT OR IGNORE INTO registrations (phone_norm, tournament, phone, name, surname, date, time) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (normalize_phone(phone), tournament, phone, name, surname, date_str, time_str),
+                        )
+                        imported += 1
+            conn.execute("INSERT INTO meta (key, value) VALUES ('csv_imported', '1')")
+            self._bump_version(conn)
+        if imported:
+            logging.info(f"📄 Импортировано заявок из {self.csv_file}: {imported}")
@@ -0,0 +1,77 @@
+import os
+import logging
+import threading
+
+GOOGLE_CREDENTIALS_FILE = os.environ.get("GOOGLE_CREDENTIALS_FILE", "google-credentials.json")
+SPREADSHEET_NAME = os.environ.get("SPREADSHEET_NAME", "Турнир заявки")
+SHEETS_BACKEND = os.environ.get("SHEETS_BACKEND", "google")  # fake — для bench/loadtest.py
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+_lock = threading.Lock()
+_spreadsheet = None
+_worksheets = {}
+_warm_up_thread = None
+
+
+def get_spreadsheet():
+    """Авторизуется и открывает таблицу один раз на процесс, при первом обращении.
+
+    Если Sheets недоступен, исключение уходит вызывающему, а следующая попытка
+    откроет таблицу заново — импорт приложения от этого не падает.
+    """
+    global _spreadsheet
+    if _spreadsheet is None:
+        with _lock:
+            if _spreadsheet is None and SHEETS_BACKEND == "fake":
+                from bench.fake_gspread import FakeSpreadsheet
+
+                _spreadsheet = FakeSpreadsheet()
+            if _spreadsheet is None:
+                # gspread и oauth2client тяжёлые — импортируем только когда они нужны
+                import gspread
+                from oauth2client.service_account import ServiceAccountCredentials
+
+                creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_CREDENTIALS_FILE, SCOPE)
+                _spreadsheet = gspread.authorize(creds).open(SPREADSHEET_NAME)
+                logging.info("📄 Таблица Google Sheets открыта")
+    return _spreadsheet
+
+
+def _get_worksheet(key, open_worksheet):
+    worksheet = _worksheets.get(key)
+    if worksheet is None:
+        spreadsheet = get_spreadsheet()
+        with _lock:
+            worksheet = _worksheets.get(key)
+            if worksheet is None:
+                worksheet = _worksheets[key] = open_worksheet(spreadsheet)
+    return worksheet
+
+
+def get_registrations_sheet():
+    return _get_worksheet("sheet1", lambda spreadsheet: spreadsheet.sheet1)
+
+
+def get_config_sheet():
+    return _get_worksheet("config", lambda spreadsheet: spreadsheet.worksheet("config"))
+
+
+def is_ready():
+    return "sheet1" in _worksheets and "config" in _worksheets
+
+
+def warm_up():
+    """Открывает таблицу и листы в фоне, чтобы первый вебхук не ждал Google."""
+    global _warm_up_thread
+    if is_ready() or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+        return
+
+    def run():
+        try:
+            get_registrations_sheet()
+            get_config_sheet()
+        except Exception as e:
+            logging.error(f"❌ Не удалось открыть Google Sheets: {e}")
+
+    _warm_up_thread = threading.Thread(target=run, name="sheets-warm-up", daemon=True)
+    _warm_up_thread.start()
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+import threading
+import metrics
+
+SHEETS_JOURNAL_DIR = os.environ.get("SHEETS_JOURNAL_DIR", "sheets_journal")
+SHEETS_BATCH_SIZE = int(os.environ.get("SHEETS_BATCH_SIZE", 50))
+SHEETS_FLUSH_INTERVAL = float(os.environ.get("SHEETS_FLUSH_INTERVAL", 1))
+SHEETS_MAX_BACKOFF = float(os.environ.get("SHEETS_MAX_BACKOFF", 300))
+
+
+class SheetsWriter:
+    """Фоновая пакетная запись строк в Google Sheets.
+
+    Каждая строка сначала дописывается в локальный журнал (с fsync), и только
+    потом попадает в очередь. Фоновый поток отправляет строки пачками через
+    append_rows и убирает их из журнала после успешной записи. Журнал каждого
+    процесса держится под flock: журналы упавших процессов подхватываются при
+    следующем старте, поэтому заявка не теряется ни при падении, ни при
+    недоступности Sheets (доставка "как минимум один раз").
+    """
+
+    def __init__(self, get_worksheet, journal_dir=SHEETS_JOURNAL_DIR, batch_size=SHEETS_BATCH_SIZE,
+                 flush_interval=SHEETS_FLUSH_INTERVAL):
+        self._get_worksheet = get_worksheet
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending = []
+        self._journal = None
+        self._pid = None
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.journal_dir, f"{os.getpid()}.jsonl")
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def start(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            # После fork потока-писателя в дочернем процессе нет — запускаем заново
+            self._pid = os.getpid()
+            self._pending = []
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._journal = open(self.journal_path, "a+", encoding="utf-8")
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._pending.extend(self._read_journal(self._journal))
+            self._adopt_orphans()
+            if self._pending:
+                logging.info(f"📄 Восстановлено из журнала строк для Sheets: {len(self._pending)}")
+            threading.Thread(target=self._run, name="sheets-writer", daemon=True).start()
+
+    def enqueue(self, row):
+        """Журналирует строку и ставит её в очередь. Возвращается без обращения к Sheets."""
+        self.start()
+        record = {"id": uuid.uuid4().hex, "row": row}
+        with self._cond:
+            self._write_journal_record(record)
+            self._pending.append(record)
+            self._cond.notify()
+
+    def _write_journal_record(self, record):
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _run(self):
+        backoff = 1
+        journal_stale = False
+        while True:
+            with self._cond:
+                while not self._pending and not journal_stale:
+                    self._cond.wait()
+                # Даём очереди немного накопиться, чтобы отправить одной пачкой;
+                # notify от enqueue будит раньше срока, поэтому ждём до дедлайна
+                deadline = time.monotonic() + self.flush_interval
+                while 0 < len(self._pending) < self.batch_size and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                batch = self._pending[:self.batch_size]
+
+            if batch:
+                try:
+                    with metrics.stage("sheets_append"):
+                        self._get_worksheet().append_rows([record["row"] for record in batch])
+                except Exception as e:
+                    logging.error(f"❌ Ошибка записи в Google Sheets (повтор через {backoff} с): {e}")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, SHEETS_MAX_BACKOFF)
+                    continue
+
+                backoff = 1
+                logging.info(f"📄 Добавлено в Google Sheets: {len(batch)}")
+                with self._cond:
+                    del self._pending[:len(batch)]
+
+            # Пока журнал не переписан, отправленные строки остаются в нём и после
+            # падения уйдут повторно — для "как минимум один раз" это допустимо.
+            # Поток при этом не должен умереть: он единственный, кто отправляет строки
+            try:
+                with self._cond:
+                    self._rewrite_journal()
+                journal_stale = False
+            except Exception as e:
+                journal_stale = True
+                logging.error(f"❌ Не удалось переписать журнал Sheets (повтор через {backoff} с): {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, SHEETS_MAX_BACKOFF)
+
+    def _rewrite_journal(self):
+        # Новый журнал пишется во временный файл и атомарно подменяет старый,
+        # чтобы падение посередине не потеряло ещё не отправленные строки
+        tmp_path = f"{self.journal_path}.tmp"
+        new_journal = open(tmp_path, "w+", encoding="utf-8")
+        try:
+            fcntl.flock(new_journal, fcntl.LOCK_EX)
+            for record in self._pending:
+                new_journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            new_journal.flush()
+            os.fsync(new_journal.fileno())
+            os.replace(tmp_path, self.journal_path)
+        except BaseException:
+            new_journal.close()
+            raise
+        old_journal, self._journal = self._journal, new_journal
+        old_journal.close()
+
+    def _adopt_orphans(self):
+        for name in os.listdir(self.journal_dir):
+            path = os.path.join(self.journal_dir, name)
+            if not name.endswith(".jsonl") or path == self.journal_path:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # журнал живого процесса
+                try:
+                    if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                        continue  # владелец только что подменил файл
+                except FileNotFoundError:
+                    continue
+                # Сначала переносим строки в свой журнал, потом удаляем чужой
+                for record in self._read_journal(f):
+                    self._write_journal_record(record)
+                    self._pending.append(record)
+                os.remove(path)
+
+    @staticmethod
+    def _read_journal(f):
+        f.seek(0)
+        records = []
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Недописанная строка после падения процесса
+                logging.warning("⚠️ Пропущена повреждённая строка журнала Sheets")
+        return records
@@ -0,0 +1,53 @@
+import time
+import logging
+
+# Точка отсчёта — импорт этого модуля, поэтому приложения импортируют его первым
+PROCESS_START = time.perf_counter()
+
+_marks = {}
+_first_request_started = None
+
+
+def elapsed_ms(since=PROCESS_START):
+    return round((time.perf_counter() - since) * 1000, 1)
+
+
+def mark(name):
+    """Запоминает момент (мс от старта процесса) первого наступления события."""
+    if name not in _marks:
+        _marks[name] = elapsed_ms()
+        logging.info(f"⏱️ {name}: {_marks[name]} мс от старта")
+
+
+def first_request_started():
+    global _first_request_started
+    if _first_request_started is None:
+        _first_request_started = time.perf_counter()
+        mark("first_request_started")
+
+
+def first_request_finished():
+    if "first_request_ms" not in _marks and _first_request_started is not None:
+        _marks["first_request_ms"] = elapsed_ms(_first_request_started)
+        mark("first_request_finished")
+        logging.info(f"⏱️ Первый запрос обработан за {_marks['first_request_ms']} мс")
+
+
+def report():
+    return dict(_marks)
+
+
+class StartupTimingMiddleware:
+    """ASGI-обёртка, замеряющая первый HTTP-запрос процесса."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        first_request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            first_request_finished()
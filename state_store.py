@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from storage import SqliteDatabase
+
+# Несколько воркеров uvicorn/gunicorn (WEB_CONCURRENCY) видят один разговор по частям —
+# состояние в памяти одного процесса им не подходит, по умолчанию тогда общий SQLite
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+STATE_STORE = os.environ.get("STATE_STORE") or ("sqlite" if WEB_CONCURRENCY > 1 else "memory")
+STATE_DB_FILE = os.environ.get("STATE_DB_FILE", "bot_state.sqlite3")
+STATE_TTL = float(os.environ.get("STATE_TTL", 24 * 60 * 60))
+STATE_DONE_TTL = float(os.environ.get("STATE_DONE_TTL", 10 * 60))
+STATE_MAX_CHATS = int(os.environ.get("STATE_MAX_CHATS", 50000))
+
+# Состояния, после которых разговор можно забыть раньше (None — ConversationHandler.END)
+FINISHED_STATES = (None, "done")
+
+
+def _expired(state, updated_at, now):
+    ttl = STATE_DONE_TTL if state in FINISHED_STATES else STATE_TTL
+    return now - updated_at > ttl
+
+
+class MemoryStateStore:
+    """Состояние разговоров в памяти процесса: LRU с ограничением размера и TTL."""
+
+    def __init__(self, max_chats=STATE_MAX_CHATS):
+        self.max_chats = max_chats
+        self._records = OrderedDict()  # chat_id -> (state, data, updated_at)
+        self._lock = threading.Lock()
+
+    def get(self, chat_id, default_state="start"):
+        with self._lock:
+            record = self._records.get(chat_id)
+            if record is None or _expired(record[0], record[2], time.time()):
+                self._records.pop(chat_id, None)
+                return default_state, {}
+            self._records.move_to_end(chat_id)
+            return record[0], dict(record[1])
+
+    def set(self, chat_id, state, data):
+        now = time.time()
+        with self._lock:
+            self._records[chat_id] = (state, dict(data), now)
+            self._records.move_to_end(chat_id)
+            # Самые старые записи в начале — чистим, пока они протухли или их слишком много
+            while self._records:
+                oldest_id, (oldest_state, _, updated_at) = next(iter(self._records.items()))
+                if len(self._records) <= self.max_chats and not _expired(oldest_state, updated_at, now):
+                    break
+                del self._records[oldest_id]
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._records.pop(chat_id, None)
+
+    def items(self):
+        now = time.time()
+        with self._lock:
+            return [(chat_id, state, dict(data)) for chat_id, (state, data, updated_at) in self._records.items()
+                    if not _expired(state, updated_at, now)]
+
+    def __len__(self):
+        return len(self._records)
+
+
+class SqliteStateStore:
+    """Состояние разговоров в SQLite: переживает рестарты и общее для всех воркеров."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            chat_id INTEGER PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS conversation_state_updated ON conversation_state (updated_at);
+    """
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, path=STATE_DB_FILE, max_chats=STATE_MAX_CHATS):
+        self.max_chats = max_chats
+        self.db = SqliteDatabase(path, self.SCHEMA)
+        self._writes = 0
+
+    def get(self, chat_id, default_state="start"):
+        rows = self.db.execute("SELECT state, data, updated_at FROM conversation_state WHERE chat_id = ?", (chat_id,))
+        if not rows:
+            return default_state, {}
+        state, data, updated_at = rows[0]
+        state = json.loads(state)
+        if _expired(state, updated_at, time.time()):
+            return default_state, {}
+        return state, json.loads(data)
+
+    def set(self, chat_id, state, data):
+        self.db.execute(
+            "INSERT OR REPLACE INTO conversation_state (chat_id, state, data, updated_at) VALUES (?, ?, ?, ?)",
+            (chat_id, json.dumps(state), json.dumps(data, ensure_ascii=False, separators=(",", ":")), time.time()),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, chat_id):
+        self.db.execute("DELETE FROM conversation_state WHERE chat_id = ?", (chat_id,))
+
+    def items(self):
+        now = time.time()
+        rows = self.db.execute("SELECT chat_id, state, data, updated_at FROM conversation_state")
+        return [(chat_id, json.loads(state), json.loads(data)) for chat_id, state, data, updated_at in rows
+                if not _expired(json.loads(state), updated_at, now)]
+
+    def prune(self):
+        now = time.time()
+        finished = [json.dumps(state) for state in FINISHED_STATES]
+        with self.db.transaction() as conn:
+            conn.execute(
+                f"DELETE FROM conversation_state WHERE updated_at < ? "
+                f"OR (state IN ({','.join('?' * len(finished))}) AND updated_at < ?)",
+                (now - STATE_TTL, *finished, now - STATE_DONE_TTL),
+            )
+            # LRU: оставляем max_chats самых свежих разговоров
+            conn.execute(
+                "DELETE FROM conversation_state WHERE chat_id IN ("
+                "SELECT chat_id FROM conversation_state ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_chats,),
+            )
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM conversation_state")[0][0]
+
+
+def create_state_store():
+    if STATE_STORE == "sqlite":
+        return SqliteStateStore()
+    if WEB_CONCURRENCY > 1:
+        raise RuntimeError(
+            f"STATE_STORE=memory не работает с WEB_CONCURRENCY={WEB_CONCURRENCY}: "
+            "шаги одного разговора попадут в разные воркеры. Уберите STATE_STORE или задайте STATE_STORE=sqlite"
+        )
+    return MemoryStateStore()
@@ -0,0 +1,83 @@
+import os
+import errno
+import fcntl
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SqliteDatabase:
+    """Общее SQLite-подключение для хранилищ бота.
+
+    WAL и busy_timeout позволяют нескольким воркерам gunicorn/uvicorn безопасно
+    работать с одним файлом. Внутри процесса запросы сериализуются блокировкой;
+    после fork подключение открывается заново.
+    """
+
+    def __init__(self, path, schema=""):
+        self.path = path
+        self.schema = schema
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            if self.schema:
+                self._conn.executescript(self.schema)
+            self._pid = os.getpid()
+        return self._conn
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция с блокировкой записи сразу (BEGIN IMMEDIATE) — атомарна и между процессами."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+
+class ChatLocks:
+    """Межпроцессные блокировки по chat_id: байтовые диапазоны одного файла (fcntl.lockf).
+
+    Захват неблокирующий — ждать (с таймаутом) должен вызывающий, не занимая
+    поток пула. Блокировки POSIX принадлежат процессу, поэтому внутри процесса
+    апдейты одного чата должны быть уже упорядочены (см. PerChatUpdateProcessor в ptb_persistence.py).
+    """
+
+    SLOTS = 1 << 62  # смещение в файле; сам файл при этом не растёт
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def _file(self):
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def try_acquire(self, chat_id):
+        try:
+            fcntl.lockf(self._file(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, chat_id % self.SLOTS)
+        except OSError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        return True
+
+    def release(self, chat_id):
+        fcntl.lockf(self._file(), fcntl.LOCK_UN, 1, chat_id % self.SLOTS)
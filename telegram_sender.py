@@ -0,0 +1,162 @@
+import os
+import time
+import queue
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_SENDER_WORKERS = int(os.environ.get("TELEGRAM_SENDER_WORKERS", 4))
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_CHAT_BURST = float(os.environ.get("TELEGRAM_CHAT_BURST", 3))
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", 5))
+TELEGRAM_TIMEOUT = float(os.environ.get("TELEGRAM_TIMEOUT", 10))
+
+
+class TokenBucket:
+    """Простой потокобезопасный token bucket: rate токенов в секунду, до capacity подряд."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self):
+        # Возвращает, сколько ещё ждать до следующего токена (0 — токен взят)
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            delay = self._take()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        # После 429 с retry_after новые токены не выдаются, пока не истечёт пауза
+        # Пауза отсчитывается от текущего момента: время до неё (в том числе сам
+        # запрос, получивший 429) не должно вернуться токенами при следующем _take
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+    def idle(self):
+        return time.monotonic() - self._updated > self.capacity / self.rate
+
+
+class TelegramSender:
+    """Исходящие сообщения в Bot API через общую сессию с пулом соединений.
+
+    Сообщения ставятся в очередь и отправляются фоновыми потоками. Чаты
+    закреплены за потоками по chat_id, поэтому порядок сообщений в одном чате
+    сохраняется. Скорость ограничивается общим и per-chat token bucket'ом,
+    429 обрабатывается по retry_after.
+    """
+
+    def __init__(self, token, api_url=TELEGRAM_API_URL, workers=TELEGRAM_SENDER_WORKERS,
+                 global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE, global_bucket=None):
+        self.base_url = f"{api_url.rstrip('/')}/bot{token}"
+        self.workers = workers
+        self.chat_rate = chat_rate
+        # global_bucket можно разделить с другим отправителем того же бота (см. broadcast.py)
+        self.global_bucket = global_bucket or TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._queues = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers * 2))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers * 2))
+
+    def start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queues = [queue.Queue() for _ in range(self.workers)]
+            for i, q in enumerate(self._queues):
+                threading.Thread(target=self._run, args=(q,), name=f"telegram-sender-{i}", daemon=True).start()
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def send_message(self, chat_id, text, **params):
+        """Ставит sendMessage в очередь и сразу возвращается."""
+        self.start()
+        payload = {"chat_id": chat_id, "text": text, **params}
+        self._queues[hash(chat_id) % self.workers].put(("sendMessage", payload))
+
+    def call(self, method, payload):
+        """Синхронный вызов Bot API с лимитами и повторами. Возвращает ответ Telegram (dict)."""
+        chat_id = payload.get("chat_id")
+        backoff = 1
+        for attempt in range(TELEGRAM_MAX_RETRIES):
+            if chat_id is not None:
+                self._chat_bucket(chat_id).acquire()
+            self.global_bucket.acquire()
+            try:
+                with metrics.stage("telegram_send"):
+                    response = self.session.post(f"{self.base_url}/{method}", json=payload, timeout=TELEGRAM_TIMEOUT)
+                    result = response.json()
+            except (requests.RequestException, ValueError) as e:
+                logging.error(f"❌ Ошибка запроса к Telegram {method} (попытка {attempt + 1}): {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            if not result.get("ok"):
+                metrics.ERRORS.inc(component="telegram_send", reason=str(response.status_code))
+            if response.status_code == 429:
+                retry_after = result.get("parameters", {}).get("retry_after", backoff)
+                logging.warning(f"⚠️ Telegram просит подождать {retry_after} с")
+                self.global_bucket.pause(retry_after)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(retry_after)
+                continue
+            if response.status_code >= 500:
+                logging.error(f"❌ Telegram вернул {response.status_code} на {method}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            if not result.get("ok"):
+                logging.error(f"❌ Telegram отклонил {method}: {result.get('description')}")
+            return result
+
+        logging.error(f"❌ Не удалось выполнить {method} после {TELEGRAM_MAX_RETRIES} попыток")
+        return {"ok": False, "description": "retries exhausted"}
+
+    def _chat_bucket(self, chat_id):
+        with self._buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) > 10000:
+                    # Полные (давно не использованные) бакеты ничего не ограничивают
+                    self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle()}
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, TELEGRAM_CHAT_BURST)
+            return bucket
+
+    def _run(self, q):
+        while True:
+            method, payload = q.get()
+            try:
+                self.call(method, payload)
+            except Exception as e:
+                logging.error(f"❌ Ошибка отправки в Telegram: {e}")
+            finally:
+                q.task_done()
@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import Counter
+from broadcast import Broadcaster
+from registration_store import RegistrationStore
+
+
+class FakeSender:
+    """TelegramSender.call без сети: чаты из blocked отвечают 403, каждая отправка длится delay."""
+
+    def __init__(self, blocked=(), delay=0):
+        self.blocked = set(blocked)
+        self.delay = delay
+        self.sent = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, method, payload):
+        time.sleep(self.delay)
+        chat_id = payload["chat_id"]
+        with self._lock:
+            self.sent[chat_id] += 1
+        if chat_id in self.blocked:
+            return {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        return {"ok": True, "result": {}}
+
+
+class Worker(Broadcaster):
+    """Broadcaster с собственным именем владельца: воркеры в тесте живут в одном процессе."""
+
+    def __init__(self, name, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+
+    @property
+    def owner(self):
+        return self.name
+
+
+def make_registrations(tmp_path, chat_ids, tournament="Летний"):
+    store = RegistrationStore(str(tmp_path / "confirmed_users.csv"), path=str(tmp_path / "registrations.sqlite3"))
+    for n, chat_id in enumerate(chat_ids):
+        store.add([f"8700{n:07d}", "Иван", "Иванов", tournament, "2026-06-01", "10:00"], chat_id=chat_id)
+    return store
+
+
+def make_worker(tmp_path, name, sender, store, **kwargs):
+    kwargs = {"concurrency": 4, "rate": 1000, "batch_size": 2, "stale_after": 60, **kwargs}
+    return Worker(name, sender, store, path=str(tmp_path / "broadcasts.sqlite3"), **kwargs)
+
+
+def wait_finished(broadcaster, broadcast_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while broadcaster.status(broadcast_id)["status"] == "running":
+        assert time.monotonic() < deadline, "рассылка не завершилась"
+        time.sleep(0.02)
+    return broadcaster.status(broadcast_id)
+
+
+def test_each_past_participant_gets_one_message(tmp_path):
+    store = make_registrations(tmp_path, [1, 2, 3])
+    # Чат 1 записывался и на другой турнир — сообщение всё равно одно
+    store.add(["87009999999", "Иван", "Иванов", "Зимний", "2026-12-01", "10:00"], chat_id=1)
+    sender = FakeSender()
+    broadcaster = make_worker(tmp_path, "a", sender, store)
+    status, error = broadcaster.create("Новый турнир!")
+    assert error is None
+    status = wait_finished(broadcaster, status["id"])
+    assert status["status"] == "done"
+    assert (status["total"], status["sent"]) == (3, 3)
+    assert sender.sent == Counter({1: 1, 2: 1, 3: 1})
+
+
+def test_registered_for_excluded_tournament_are_skipped(tmp_path):
+    store = make_registrations(tmp_path, [1, 2])
+    store.add(["87009999999", "Иван", "Иванов", "Зимний", "2026-12-01", "10:00"], chat_id=3)
+    sender = FakeSender()
+    broadcaster = make_worker(tmp_path, "a", sender, store)
+    status, _ = broadcaster.create("Зимний турнир!", exclude_tournament="Летний")
+    wait_finished(broadcaster, status["id"])
+    assert set(sender.sent) == {3}
+
+
+def test_blocked_bot_is_recorded(tmp_path):
+    store = make_registrations(tmp_path, [1, 2, 3])
+    broadcaster = make_worker(tmp_path, "a", FakeSender(blocked={2}), store)
+    status, _ = broadcaster.create("Новый турнир!")
+    status = wait_finished(broadcaster, status["id"])
+    assert (status["sent"], status["blocked"], status["failed"]) == (2, 1, 0)
+    assert broadcaster.db.execute("SELECT status FROM broadcast_recipients WHERE chat_id = 2") == [("blocked",)]
+
+
+def test_only_one_broadcast_runs_at_a_time(tmp_path):
+    store = make_registrations(tmp_path, [1, 2, 3])
+    broadcaster = make_worker(tmp_path, "a", FakeSender(delay=0.2), store, concurrency=1)
+    first, _ = broadcaster.create("Первая")
+    assert broadcaster.create("Вторая") == (None, f"рассылка {first['id']} ещё идёт")
+    wait_finished(broadcaster, first["id"])
+
+
+def test_crashed_broadcast_is_resumed_from_pending(tmp_path, monkeypatch):
+    store = make_registrations(tmp_path, [1, 2, 3, 4])
+    crashed = make_worker(tmp_path, "crashed", FakeSender(), store, stale_after=0.2)
+    # Воркер создал рассылку, отправил первым двум и упал
+    monkeypatch.setattr(crashed, "_spawn", lambda broadcast_id: None)
+    status, _ = crashed.create("Новый турнир!")
+    crashed.db.execute("UPDATE broadcast_recipients SET status = 'sent' WHERE chat_id IN (1, 2)")
+    crashed.db.execute("UPDATE broadcasts SET heartbeat = heartbeat - 1")
+
+    sender = FakeSender()
+    survivor = make_worker(tmp_path, "survivor", sender, store, stale_after=0.2)
+    survivor.start()
+    status = wait_finished(survivor, status["id"])
+    assert status["status"] == "done"
+    assert status["owner"] == "survivor"
+    assert sender.sent == Counter({3: 1, 4: 1})
+
+
+def test_slow_batch_is_not_taken_over(tmp_path):
+    # Пачка из 4 сообщений по 0.2 с в один поток идёт дольше stale_after
+    store = make_registrations(tmp_path, [1, 2, 3, 4])
+    sender = FakeSender(delay=0.2)
+    owner = make_worker(tmp_path, "owner", sender, store, concurrency=1, batch_size=4, stale_after=0.3)
+    watcher = make_worker(tmp_path, "watcher", sender, store, concurrency=1, batch_size=4, stale_after=0.3)
+    watcher.start()
+    status, _ = owner.create("Новый турнир!")
+    status = wait_finished(owner, status["id"])
+    assert status["owner"] == "owner"
+    assert sender.sent == Counter({1: 1, 2: 1, 3: 1, 4: 1})
+
+
+def test_cancel_stops_the_batch_in_progress(tmp_path):
+    store = make_registrations(tmp_path, range(1, 11))
+    sender = FakeSender(delay=0.1)
+    broadcaster = make_worker(tmp_path, "a", sender, store, concurrency=1, batch_size=10, stale_after=0.3)
+    status, _ = broadcaster.create("Новый турнир!")
+    time.sleep(0.15)
+    assert broadcaster.cancel(status["id"])["status"] == "cancelled"
+    time.sleep(0.5)
+    assert sum(sender.sent.values()) < 10
+    status = broadcaster.status(status["id"])
+    assert status["sent"] == sum(sender.sent.values())
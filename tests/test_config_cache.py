@@ -0,0 +1,141 @@
+import json
+import time
+import threading
+import pytest
+import config_cache
+from config_cache import TournamentConfigCache
+
+
+class FakeConfigSheet:
+    """Лист config с batch_get, как в bench/fake_gspread.py, но управляемый из теста.
+
+    error — исключение на следующие чтения; пока gate не открыт, batch_get ждёт.
+    """
+
+    def __init__(self, tournament="Летний", description="Описание"):
+        self.cells = {"B1": tournament, "B2": description, "B3": "16"}
+        self.error = None
+        self.gate = threading.Event()
+        self.gate.set()
+        self.calls = 0
+
+    def batch_get(self, ranges):
+        self.gate.wait()
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return [[[self.cells[label]]] if self.cells.get(label) else [] for label in ranges]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "не дождались"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fallback_file(tmp_path):
+    return str(tmp_path / "tournament_config.json")
+
+
+def write_fallback(path, tournament):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"current_tournament": tournament, "tournament_description": "Из файла"}, f, ensure_ascii=False)
+
+
+@pytest.fixture(autouse=True)
+def short_timeouts(monkeypatch):
+    monkeypatch.setattr(config_cache, "CONFIG_LOAD_TIMEOUT", 0.2)
+    monkeypatch.setattr(config_cache, "CONFIG_RETRY_DELAY", 0.1)
+
+
+def test_values_are_read_once_and_cached(fallback_file):
+    sheet = FakeConfigSheet()
+    cache = TournamentConfigCache(lambda: sheet, ttl=60, fallback_file=fallback_file)
+    assert cache.get("current_tournament") == "Летний"
+    assert cache.get("tournament_capacity") == "16"
+    assert cache.values() == {"current_tournament": "Летний", "tournament_description": "Описание",
+                              "tournament_capacity": "16"}
+    assert sheet.calls == 1
+    # Удачный снимок сохраняется на случай недоступности Sheets
+    with open(fallback_file, encoding="utf-8") as f:
+        assert json.load(f)["current_tournament"] == "Летний"
+
+
+def test_expired_value_is_served_while_refreshing_in_background(fallback_file):
+    sheet = FakeConfigSheet()
+    cache = TournamentConfigCache(lambda: sheet, ttl=0.05, fallback_file=fallback_file)
+    cache.get("current_tournament")
+    time.sleep(0.1)
+    sheet.cells["B1"] = "Зимний"
+    sheet.gate.clear()
+    started = time.monotonic()
+    # TTL истёк, а Sheets отвечает медленно: запросы получают старое значение сразу
+    assert [cache.get("current_tournament") for _ in range(5)] == ["Летний"] * 5
+    assert time.monotonic() - started < 0.1
+    sheet.gate.set()
+    wait_for(lambda: cache.get("current_tournament") == "Зимний")
+    # Пять запросов с истёкшим TTL — одно фоновое чтение
+    assert sheet.calls == 2
+
+
+def test_fallback_file_when_sheets_fails_on_start(fallback_file):
+    write_fallback(fallback_file, "Из снимка")
+    sheet = FakeConfigSheet()
+    sheet.error = ConnectionError("Sheets недоступен")
+    cache = TournamentConfigCache(lambda: sheet, fallback_file=fallback_file)
+    assert cache.get("current_tournament") == "Из снимка"
+    assert cache.get("tournament_capacity") == ""
+    # Повтор — через CONFIG_RETRY_DELAY, в фоне
+    sheet.error = None
+    time.sleep(0.15)
+    cache.get("current_tournament")
+    wait_for(lambda: cache.get("current_tournament") == "Летний")
+
+
+def test_fallback_file_when_sheets_times_out_on_start(fallback_file):
+    write_fallback(fallback_file, "Из снимка")
+    sheet = FakeConfigSheet()
+    sheet.gate.clear()
+    cache = TournamentConfigCache(lambda: sheet, fallback_file=fallback_file)
+    started = time.monotonic()
+    assert cache.get("current_tournament") == "Из снимка"
+    assert time.monotonic() - started < 1
+    # Загрузка продолжается в фоне и подменяет снимок
+    sheet.gate.set()
+    wait_for(lambda: cache.get("current_tournament") == "Летний")
+
+
+def test_missing_fallback_file_gives_defaults(fallback_file):
+    sheet = FakeConfigSheet()
+    sheet.error = ConnectionError("Sheets недоступен")
+    cache = TournamentConfigCache(lambda: sheet, fallback_file=fallback_file)
+    assert cache.get("current_tournament", "нет") == "нет"
+
+
+def test_failed_refresh_keeps_last_values(fallback_file):
+    sheet = FakeConfigSheet()
+    cache = TournamentConfigCache(lambda: sheet, ttl=0.05, fallback_file=fallback_file)
+    cache.get("current_tournament")
+    write_fallback(fallback_file, "Из снимка")
+    sheet.error = ConnectionError("Sheets недоступен")
+    time.sleep(0.1)
+    cache.get("current_tournament")
+    wait_for(lambda: sheet.calls == 2)
+    # Последнее значение из Sheets важнее файла
+    assert cache.get("current_tournament") == "Летний"
+
+
+def test_invalidate_rereads_synchronously(fallback_file):
+    sheet = FakeConfigSheet()
+    cache = TournamentConfigCache(lambda: sheet, ttl=60, fallback_file=fallback_file)
+    cache.get("current_tournament")
+    sheet.cells["B1"] = "Зимний"
+    assert cache.get("current_tournament") == "Летний"
+    assert cache.invalidate() is True
+    assert cache.get("current_tournament") == "Зимний"
+
+    sheet.error = ConnectionError("Sheets недоступен")
+    assert cache.invalidate() is False
+    assert cache.get("current_tournament") == "Зимний"
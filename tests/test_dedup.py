@@ -0,0 +1,60 @@
+import pytest
+from dedup import MemoryUpdateDeduplicator, SqliteUpdateDeduplicator
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_dedup(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryUpdateDeduplicator(**kwargs)
+        kwargs.pop("max_updates", None)
+        return SqliteUpdateDeduplicator(path=str(tmp_path / "dedup.sqlite3"), **kwargs)
+    return make
+
+
+def test_redelivered_update_is_dropped(make_dedup):
+    dedup = make_dedup()
+    assert not dedup.seen(10, chat_id=1)
+    assert dedup.seen(10, chat_id=1)
+    assert not dedup.seen(11, chat_id=1)
+
+
+def test_older_update_of_same_chat_is_dropped(make_dedup):
+    dedup = make_dedup()
+    assert not dedup.seen(20, chat_id=1)
+    assert dedup.seen(19, chat_id=1)
+    # Порядок проверяется только внутри чата
+    assert not dedup.seen(18, chat_id=2)
+    assert not dedup.seen(17)
+
+
+def test_forget_lets_retry_through(make_dedup):
+    dedup = make_dedup()
+    assert not dedup.seen(30, chat_id=1)
+    dedup.forget(30)
+    assert not dedup.seen(30, chat_id=1)
+    assert dedup.seen(30, chat_id=1)
+
+
+def test_update_outside_window_is_processed_again(make_dedup):
+    dedup = make_dedup(window=-1)
+    assert not dedup.seen(40)
+    if isinstance(dedup, SqliteUpdateDeduplicator):
+        dedup.prune()
+    assert not dedup.seen(40)
+
+
+def test_memory_window_is_bounded_by_size():
+    dedup = MemoryUpdateDeduplicator(max_updates=2)
+    for update_id in (1, 2, 3):
+        assert not dedup.seen(update_id)
+    assert len(dedup._seen) == 2
+    assert not dedup.seen(1)
+
+
+def test_sqlite_window_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "dedup.sqlite3")
+    first, second = SqliteUpdateDeduplicator(path=path), SqliteUpdateDeduplicator(path=path)
+    assert not first.seen(50, chat_id=1)
+    assert second.seen(50, chat_id=1)
+    assert second.seen(49, chat_id=1)
@@ -0,0 +1,137 @@
+import csv
+import io
+import gzip
+import json
+import types
+from email.utils import formatdate
+import pytest
+import export
+from export import prepare_export
+from registration_store import CSV_HEADER, RegistrationStore
+
+
+def make_row(n, tournament="Летний", day="2026-06-01"):
+    return [f"8700{n:07d}", "Иван", f"Иванов{n}", tournament, day, "10:00"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RegistrationStore(str(tmp_path / "confirmed_users.csv"), path=str(tmp_path / "registrations.sqlite3"))
+    store.add(make_row(1, day="2026-06-01"), chat_id=1, capacity=3)
+    store.add(make_row(2, day="2026-06-05"), chat_id=2, capacity=3)
+    store.add(make_row(3, day="2026-06-10"), chat_id=3, capacity=3)
+    store.add(make_row(4, day="2026-06-10"), chat_id=4, capacity=3)  # лист ожидания
+    store.add(make_row(5, tournament="Зимний", day="2026-12-01"), chat_id=5)
+    return store
+
+
+def export_rows(store, args=None, headers=None):
+    status, response_headers, body = prepare_export(store, args or {}, headers or {})
+    data = b"".join(body)
+    if response_headers.get("Content-Encoding") == "gzip":
+        data = gzip.decompress(data)
+    return status, response_headers, data
+
+
+def csv_rows(data):
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8"))))
+    assert rows[0] == CSV_HEADER
+    return rows[1:]
+
+
+def test_csv_export_streams_confirmed_rows(store, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_CHUNK_ROWS", 2)
+    status, headers, body = prepare_export(store, {}, {})
+    assert status == 200
+    assert isinstance(body, types.GeneratorType)
+    chunks = list(body)
+    assert len(chunks) == 2
+    assert headers["Content-Type"] == "text/csv; charset=utf-8"
+    assert csv_rows(b"".join(chunks)) == [make_row(1, day="2026-06-01"), make_row(2, day="2026-06-05"),
+                                          make_row(3, day="2026-06-10"), make_row(5, "Зимний", "2026-12-01")]
+
+
+def test_json_export(store, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_CHUNK_ROWS", 2)
+    status, headers, data = export_rows(store, {"format": "json", "tournament": "Летний"})
+    assert status == 200
+    assert headers["Content-Type"] == "application/json; charset=utf-8"
+    assert [item["surname"] for item in json.loads(data)] == ["Иванов1", "Иванов2", "Иванов3"]
+
+
+@pytest.mark.parametrize("args, surnames", [
+    ({"tournament": "Зимний"}, ["Иванов5"]),
+    ({"status": "waitlist"}, ["Иванов4"]),
+    ({"from": "2026-06-05"}, ["Иванов2", "Иванов3", "Иванов5"]),
+    ({"to": "2026-06-05"}, ["Иванов1", "Иванов2"]),
+    ({"tournament": "Летний", "from": "2026-06-02", "to": "2026-06-09"}, ["Иванов2"]),
+])
+def test_filters(store, args, surnames):
+    status, _, data = export_rows(store, args)
+    assert status == 200
+    assert [row[2] for row in csv_rows(data)] == surnames
+
+
+@pytest.mark.parametrize("args", [
+    {"format": "pdf"},
+    {"status": "cancelled"},
+    {"from": "01.06.2026"},
+    {"to": "2026-13-01"},
+])
+def test_bad_input_is_rejected(store, args):
+    status, headers, data = export_rows(store, args)
+    assert status == 400
+    assert headers["Content-Type"].startswith("text/plain")
+    assert data
+
+
+def test_xlsx_without_openpyxl_is_rejected(store, monkeypatch):
+    monkeypatch.setattr(export, "openpyxl", None)
+    assert export_rows(store, {"format": "xlsx"})[0] == 400
+
+
+def test_gzip_when_accepted(store):
+    status, headers, data = export_rows(store, {}, {"Accept-Encoding": "gzip, deflate"})
+    assert status == 200
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Vary"] == "Accept-Encoding"
+    assert len(csv_rows(data)) == 4
+
+
+def test_etag_and_if_none_match(store):
+    _, headers, _ = export_rows(store)
+    status, not_modified_headers, data = export_rows(store, {}, {"If-None-Match": headers["ETag"]})
+    assert (status, data) == (304, b"")
+    assert not_modified_headers["ETag"] == headers["ETag"]
+    assert export_rows(store, {}, {"If-None-Match": f'"other", {headers["ETag"]}'})[0] == 304
+    assert export_rows(store, {}, {"If-None-Match": "*"})[0] == 304
+    # ETag зависит от фильтров, формата и сжатия
+    assert export_rows(store, {"format": "json"})[1]["ETag"] != headers["ETag"]
+    assert export_rows(store, {}, {"Accept-Encoding": "gzip"})[1]["ETag"] != headers["ETag"]
+
+
+def test_new_registration_changes_etag(store):
+    _, headers, _ = export_rows(store)
+    store.add(make_row(6), chat_id=6)
+    status, new_headers, _ = export_rows(store, {}, {"If-None-Match": headers["ETag"]})
+    assert status == 200
+    assert new_headers["ETag"] != headers["ETag"]
+
+
+def test_if_modified_since(store):
+    _, headers, _ = export_rows(store)
+    assert export_rows(store, {}, {"If-Modified-Since": headers["Last-Modified"]})[0] == 304
+    _, modified_at = store.version()
+    earlier = formatdate(int(modified_at) - 60, usegmt=True)
+    assert export_rows(store, {}, {"If-Modified-Since": earlier})[0] == 200
+    assert export_rows(store, {}, {"If-Modified-Since": "вчера"})[0] == 200
+    # If-None-Match важнее If-Modified-Since
+    assert export_rows(store, {}, {"If-None-Match": '"other"', "If-Modified-Since": headers["Last-Modified"]})[0] == 200
+
+
+def test_empty_store(tmp_path):
+    store = RegistrationStore(str(tmp_path / "confirmed_users.csv"), path=str(tmp_path / "registrations.sqlite3"))
+    status, headers, data = export_rows(store)
+    assert status == 200
+    assert "ETag" not in headers
+    assert data.decode("utf-8") == "Нет данных для выгрузки"
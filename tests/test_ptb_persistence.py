@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import asyncio
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler, MessageHandler, filters
+from bench.fake_telegram import FakeTelegram
+from ptb_persistence import PerChatUpdateProcessor, StateStorePersistence, store_conversations
+from state_store import MemoryStateStore, SqliteStateStore
+from storage import ChatLocks
+
+
+def make_update(update_id, chat_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "x",
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Тест"},
+        },
+    }, None)
+
+
+def run_updates(processor, updates):
+    """Обрабатывает [(update, секунды)] параллельно; возвращает update_id -> (начало, конец) от старта."""
+    started = time.monotonic()
+    timings = {}
+
+    async def handle(update, seconds):
+        begin = time.monotonic() - started
+        await asyncio.sleep(seconds)
+        timings[update.update_id] = (begin, time.monotonic() - started)
+
+    async def main():
+        await asyncio.gather(*(processor.process_update(update, handle(update, seconds)) for update, seconds in updates))
+
+    asyncio.run(main())
+    return timings
+
+
+def test_updates_of_one_chat_run_in_order():
+    timings = run_updates(PerChatUpdateProcessor(8), [(make_update(1, 1), 0.1), (make_update(2, 1), 0)])
+    assert timings[2][0] >= timings[1][1]
+
+
+def test_queued_chat_does_not_take_all_slots():
+    # Два слота: апдейты чата 1 ждут друг друга, чат 2 проходит сразу
+    processor = PerChatUpdateProcessor(2)
+    timings = run_updates(processor, [(make_update(1, 1), 0.5), (make_update(2, 1), 0.5), (make_update(3, 2), 0)])
+    assert timings[3][1] < 0.2
+    assert timings[2][0] >= timings[1][1]
+    assert processor._queues == {}
+
+
+HOLD_CHAT_LOCK = """
+import sys, time
+from storage import ChatLocks
+ChatLocks(sys.argv[1]).try_acquire(1)
+print("locked", flush=True)
+time.sleep(0.5)
+"""
+
+
+def test_chat_locked_by_another_worker_does_not_take_a_slot(tmp_path):
+    path = str(tmp_path / "chats.lock")
+    processor = PerChatUpdateProcessor(1, ChatLocks(path))
+
+    async def main():
+        # Блокировки lockf принадлежат процессу, поэтому другой воркер — отдельный процесс
+        holder = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", HOLD_CHAT_LOCK, path,
+            stdout=asyncio.subprocess.PIPE, env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__)))},
+        )
+        await holder.stdout.readline()
+        started = time.monotonic()
+        finished = {}
+
+        async def handle(update):
+            finished[update.update_id] = time.monotonic() - started
+
+        await asyncio.gather(
+            processor.process_update(make_update(1, 1), handle(make_update(1, 1))),
+            processor.process_update(make_update(2, 2), handle(make_update(2, 2))),
+        )
+        await holder.wait()
+        return finished
+
+    finished = asyncio.run(main())
+    assert finished[2] < 0.2
+    assert finished[1] > 0.3
+
+
+def make_text_update(bot, update_id, chat_id, text):
+    message = {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Тест"},
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+def build_worker(telegram_url, store, registered):
+    """Упрощённый app.py: /start → имя → фамилия, состояние через store_conversations."""
+    NAME, SURNAME = range(2)
+
+    async def start(update, context):
+        return NAME
+
+    async def name(update, context):
+        context.user_data["name"] = update.message.text
+        return SURNAME
+
+    async def surname(update, context):
+        registered.append((context.user_data["name"], update.message.text))
+        return ConversationHandler.END
+
+    application = (
+        ApplicationBuilder().token("test").base_url(f"{telegram_url}/bot")
+        .persistence(StateStorePersistence(store)).updater(None).build()
+    )
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("start", start)],
+        states={NAME: [MessageHandler(filters.TEXT, name)], SURNAME: [MessageHandler(filters.TEXT, surname)]},
+        fallbacks=[],
+        name="registration",
+        persistent=True,
+    )
+    application.add_handler(conv_handler)
+    store_conversations(application, conv_handler)
+    return application
+
+
+def test_conversation_continues_in_another_worker(tmp_path):
+    # Проверяет и то, на что store_conversations опирается внутри PTB (см. requirements.txt)
+    fake = FakeTelegram(latency_ms=0).start()
+    registered = []
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        workers = [build_worker(fake.url, SqliteStateStore(path), registered) for _ in range(2)]
+        for worker in workers:
+            await worker.initialize()
+        steps = ["/start", "Иван", "Иванов", "Пётр"]
+        for update_id, text in enumerate(steps):
+            worker = workers[update_id % 2]
+            await worker.process_update(make_text_update(worker.bot, update_id, 1, text))
+        for worker in workers:
+            await worker.shutdown()
+
+    try:
+        asyncio.run(main())
+    finally:
+        fake.stop()
+    # "Пётр" пришёл после конца разговора и никуда не попал
+    assert registered == [("Иван", "Иванов")]
+    assert SqliteStateStore(path).get(1, default_state="start") == (None, {"name": "Иван"})
+
+
+def test_ptb_keeps_no_per_chat_data_between_updates(tmp_path):
+    fake = FakeTelegram(latency_ms=0).start()
+    registered = []
+    store = MemoryStateStore(max_chats=2)
+
+    async def main():
+        application = build_worker(fake.url, store, registered)
+        await application.initialize()
+        update_ids = iter(range(100))
+
+        async def send(chat_id, text):
+            await application.process_update(make_text_update(application.bot, next(update_ids), chat_id, text))
+
+        # Пять брошенных на середине разговоров, store помнит только два последних
+        for chat_id in range(1, 6):
+            await send(chat_id, "/start")
+            await send(chat_id, "Иван")
+        await application.update_persistence()
+        conv_handler = application.handlers[0][0]
+        leftovers = (
+            dict(application.user_data), dict(application.chat_data), dict(conv_handler._conversations),
+            application._user_ids_to_be_updated_in_persistence, application._chat_ids_to_be_updated_in_persistence,
+        )
+        # Разговор из store продолжается, вытесненный начинается заново
+        await send(5, "Иванов")
+        await send(1, "Иванов")
+        await application.shutdown()
+        return leftovers
+
+    try:
+        leftovers = asyncio.run(main())
+    finally:
+        fake.stop()
+    assert leftovers == ({}, {}, {}, set(), set())
+    assert len(store) == 2
+    assert registered == [("Иван", "Иванов")]
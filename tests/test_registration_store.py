@@ -0,0 +1,193 @@
+import csv
+import time
+import sqlite3
+import multiprocessing
+import pytest
+from registration_store import CONFIRMED, WAITLIST, CSV_HEADER, RegistrationStore
+
+TOURNAMENT = "Летний"
+
+
+def make_row(n, tournament=TOURNAMENT):
+    return [f"8700{n:07d}", "Иван", f"Иванов{n}", tournament, "2026-06-01", "10:00"]
+
+
+def open_store(tmp_path):
+    return RegistrationStore(str(tmp_path / "confirmed_users.csv"), path=str(tmp_path / "registrations.sqlite3"))
+
+
+def seats(store, tournament=TOURNAMENT):
+    return store.db.execute("SELECT confirmed FROM seats WHERE tournament = ?", (tournament,))[0][0]
+
+
+def read_csv(store):
+    with open(store.csv_file, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def wait_csv_rebuild(store, timeout=10):
+    deadline = time.monotonic() + timeout
+    while store.db.execute("SELECT 1 FROM meta WHERE key = 'csv_dirty'"):
+        assert time.monotonic() < deadline, "CSV не пересобран"
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return open_store(tmp_path)
+
+
+def test_duplicate_phone_is_rejected_after_normalization(store):
+    assert store.add(make_row(1), chat_id=1) == (CONFIRMED, [])
+    duplicate = make_row(1)
+    duplicate[0] = "+7" + duplicate[0][1:]
+    assert store.add(duplicate, chat_id=2) == (None, [])
+    assert store.add(make_row(1, tournament="Зимний"), chat_id=1)[0] == CONFIRMED
+
+
+def test_registrations_over_capacity_go_to_waitlist(store):
+    statuses = [store.add(make_row(n), chat_id=n, capacity=2)[0] for n in range(4)]
+    assert statuses == [CONFIRMED, CONFIRMED, WAITLIST, WAITLIST]
+    assert seats(store) == 2
+    assert len(list(store.iter_rows(status=WAITLIST))) == 2
+    # В CSV попадают только подтверждённые
+    assert read_csv(store) == [CSV_HEADER, make_row(0), make_row(1)]
+
+
+def test_zero_capacity_means_unlimited(store):
+    assert {store.add(make_row(n), chat_id=n)[0] for n in range(5)} == {CONFIRMED}
+    # Счётчик заполняется, когда вместимость впервые задана
+    assert store.add(make_row(5), chat_id=5, capacity=5)[0] == WAITLIST
+    assert seats(store) == 5
+
+
+def test_cancel_promotes_waitlist_in_registration_order(store):
+    for n in range(4):
+        store.add(make_row(n), chat_id=n, capacity=2)
+
+    cancelled, promoted = store.cancel(0, TOURNAMENT, capacity=2)
+    assert cancelled == [(make_row(0), CONFIRMED)]
+    assert promoted == [(make_row(2), 2)]
+    assert seats(store) == 2
+
+    _, promoted = store.cancel(1, TOURNAMENT, capacity=2)
+    assert promoted == [(make_row(3), 3)]
+    assert list(store.iter_rows(status=WAITLIST)) == []
+
+
+def test_cancel_of_waitlisted_does_not_free_a_seat(store):
+    for n in range(4):
+        store.add(make_row(n), chat_id=n, capacity=2)
+    cancelled, promoted = store.cancel(3, TOURNAMENT, capacity=2)
+    assert cancelled == [(make_row(3), WAITLIST)]
+    assert promoted == []
+    assert seats(store) == 2
+    assert store.cancel(3, TOURNAMENT, capacity=2) == ([], [])
+
+
+def test_new_registration_does_not_jump_the_waitlist(store):
+    store.add(make_row(0), chat_id=0, capacity=1)
+    assert store.add(make_row(1), chat_id=1, capacity=1)[0] == WAITLIST
+    # Место добавилось: его получает лист ожидания, новая заявка встаёт в очередь
+    status, promoted = store.add(make_row(2), chat_id=2, capacity=2)
+    assert promoted == [(make_row(1), 1)]
+    assert status == WAITLIST
+
+
+def test_promote_after_capacity_raised(store):
+    for n in range(5):
+        store.add(make_row(n), chat_id=n, capacity=2)
+    assert store.promote(TOURNAMENT, capacity=4) == [(make_row(2), 2), (make_row(3), 3)]
+    assert store.promote(TOURNAMENT, capacity=4) == []
+    assert seats(store) == 4
+
+
+def test_csv_is_rebuilt_after_cancel(store):
+    for n in range(3):
+        store.add(make_row(n), chat_id=n, capacity=2)
+    store.cancel(0, TOURNAMENT, capacity=2)
+    store.add(make_row(3), chat_id=3, capacity=2)
+    wait_csv_rebuild(store)
+    rows = read_csv(store)
+    assert rows[0] == CSV_HEADER
+    assert sorted(rows[1:]) == sorted([make_row(1), make_row(2)])
+
+
+def test_export_version_changes_on_every_write(store):
+    before = store.version()[0]
+    store.add(make_row(0), chat_id=0)
+    store.cancel(0, TOURNAMENT)
+    assert store.version()[0] == before + 2
+
+
+def create_legacy_database(tmp_path):
+    # Схема до появления вместимости турниров: без status и confirmed_version
+    conn = sqlite3.connect(tmp_path / "registrations.sqlite3")
+    conn.executescript("""
+        CREATE TABLE registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, phone_norm TEXT NOT NULL, tournament TEXT NOT NULL,
+            phone TEXT NOT NULL, name TEXT NOT NULL, surname TEXT NOT NULL, date TEXT NOT NULL,
+            time TEXT NOT NULL, chat_id INTEGER, UNIQUE (phone_norm, tournament)
+        );
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        INSERT INTO meta VALUES ('csv_imported', '1');
+    """)
+    conn.executemany(
+        "INSERT INTO registrations (phone_norm, tournament, phone, name, surname, date, time, chat_id) "
+        "VALUES (?, ?, ?, 'Иван', 'Иванов', '2026-06-01', '10:00', ?)",
+        [(str(n), TOURNAMENT, str(n), n) for n in range(3)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_database_is_migrated(tmp_path):
+    create_legacy_database(tmp_path)
+    store = open_store(tmp_path)
+    assert len(list(store.iter_rows())) == 3
+    # Счётчик мест заполняется по уже существующим заявкам
+    assert store.add(make_row(10), chat_id=10, capacity=4)[0] == CONFIRMED
+    assert store.add(make_row(11), chat_id=11, capacity=4)[0] == WAITLIST
+    assert seats(store) == 4
+
+
+def _open_store_in_process(tmp_dir):
+    import pathlib
+    open_store(pathlib.Path(tmp_dir))
+
+
+def _add_in_process(tmp_dir, first, count, capacity):
+    import pathlib
+    store = open_store(pathlib.Path(tmp_dir))
+    return [store.add(make_row(n), chat_id=n, capacity=capacity)[0] for n in range(first, first + count)]
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_workers_start_together(tmp_path, legacy):
+    context = multiprocessing.get_context("spawn")
+    # Гонка миграции вероятностная — несколько раундов на свежих базах
+    for round_number in range(3):
+        directory = tmp_path / str(round_number)
+        directory.mkdir()
+        if legacy:
+            create_legacy_database(directory)
+        processes = [context.Process(target=_open_store_in_process, args=(str(directory),)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+        assert [process.exitcode for process in processes] == [0] * 4
+
+
+def test_concurrent_add_from_several_processes_respects_capacity(tmp_path):
+    open_store(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(4) as pool:
+        results = pool.starmap(_add_in_process, [(str(tmp_path), k * 25, 25, 30) for k in range(4)])
+    statuses = [status for result in results for status in result]
+    assert statuses.count(CONFIRMED) == 30
+    assert statuses.count(WAITLIST) == 70
+
+    store = open_store(tmp_path)
+    assert seats(store) == 30
+    assert len(read_csv(store)) == 31
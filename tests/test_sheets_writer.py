@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import pytest
+from sheets_writer import SheetsWriter
+
+
+class FlakyWorksheet:
+    """append_rows падает первые failures раз, потом записывает строки."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.rows = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def append_rows(self, rows, **kwargs):
+        with self._lock:
+            self.calls += 1
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("Sheets недоступен")
+            self.rows.extend(rows)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "не дождались"
+        time.sleep(0.02)
+
+
+def journal_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+
+def make_writer(worksheet, journal_dir):
+    return SheetsWriter(lambda: worksheet, journal_dir=journal_dir, batch_size=10, flush_interval=0.05)
+
+
+def test_rows_are_sent_in_batches_and_removed_from_journal(journal_dir):
+    worksheet = FlakyWorksheet()
+    writer = make_writer(worksheet, journal_dir)
+    for n in range(25):
+        writer.enqueue([str(n)])
+    wait_for(lambda: len(worksheet.rows) == 25)
+    assert worksheet.rows == [[str(n)] for n in range(25)]
+    assert worksheet.calls <= 4
+    wait_for(lambda: journal_records(writer.journal_path) == [])
+
+
+def test_rows_are_kept_until_sheets_recovers(journal_dir):
+    worksheet = FlakyWorksheet(failures=1)
+    writer = make_writer(worksheet, journal_dir)
+    writer.enqueue(["1"])
+    # Пока Sheets недоступен, строка лежит в журнале
+    wait_for(lambda: worksheet.calls == 1)
+    assert [record["row"] for record in journal_records(writer.journal_path)] == [["1"]]
+    wait_for(lambda: worksheet.rows == [["1"]])
+    wait_for(lambda: writer.pending_count() == 0)
+
+
+def test_orphaned_journal_is_adopted(journal_dir):
+    os.makedirs(journal_dir)
+    # Журнал упавшего процесса, последняя строка недописана
+    orphan = os.path.join(journal_dir, "999999999.jsonl")
+    with open(orphan, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "a", "row": ["старая"]}, ensure_ascii=False) + "\n")
+        f.write('{"id": "b", "row": ["обор')
+    worksheet = FlakyWorksheet()
+    writer = make_writer(worksheet, journal_dir)
+    writer.start()
+    assert not os.path.exists(orphan)
+    wait_for(lambda: worksheet.rows == [["старая"]])
+
+
+def test_journal_of_live_process_is_not_adopted(journal_dir):
+    os.makedirs(journal_dir)
+    live = os.path.join(journal_dir, "999999998.jsonl")
+    with open(live, "w", encoding="utf-8") as owner:
+        owner.write(json.dumps({"id": "a", "row": ["чужая"]}) + "\n")
+        owner.flush()
+        fcntl.flock(owner, fcntl.LOCK_EX)
+        worksheet = FlakyWorksheet()
+        writer = make_writer(worksheet, journal_dir)
+        writer.enqueue(["своя"])
+        wait_for(lambda: worksheet.rows == [["своя"]])
+        assert os.path.exists(live)
+
+
+def test_writer_survives_journal_rewrite_error(journal_dir, monkeypatch):
+    worksheet = FlakyWorksheet()
+    writer = make_writer(worksheet, journal_dir)
+    rewrite = writer._rewrite_journal
+    failures = [OSError(28, "No space left on device")]
+
+    def failing_rewrite():
+        if failures:
+            raise failures.pop()
+        rewrite()
+
+    monkeypatch.setattr(writer, "_rewrite_journal", failing_rewrite)
+    writer.enqueue(["1"])
+    wait_for(lambda: worksheet.rows == [["1"]])
+    # Поток жив: следующая строка тоже уходит, а журнал потом всё-таки сжимается
+    writer.enqueue(["2"])
+    wait_for(lambda: worksheet.rows == [["1"], ["2"]])
+    wait_for(lambda: journal_records(writer.journal_path) == [])
@@ -0,0 +1,46 @@
+import time
+from telegram_sender import TokenBucket
+
+
+def elapsed(func):
+    started = time.monotonic()
+    func()
+    return time.monotonic() - started
+
+
+def test_burst_up_to_capacity_then_rate():
+    bucket = TokenBucket(rate=20, capacity=3)
+    assert elapsed(lambda: [bucket.acquire() for _ in range(3)]) < 0.02
+    # Следующий токен — через 1 / rate
+    assert 0.03 < elapsed(bucket.acquire) < 0.2
+
+
+def test_pause_blocks_new_tokens_for_retry_after():
+    bucket = TokenBucket(rate=100, capacity=5)
+    bucket.pause(0.2)
+    assert 0.18 < elapsed(bucket.acquire) < 0.5
+    # После паузы запас снова копится с нуля, а не сразу до capacity
+    assert elapsed(bucket.acquire) > 0.005
+
+
+def test_pause_counts_from_now_after_idle_time():
+    bucket = TokenBucket(rate=10, capacity=1)
+    bucket.acquire()
+    # Запрос, получивший 429, шёл дольше, чем копится токен
+    time.sleep(0.3)
+    bucket.pause(0.5)
+    assert 0.48 < elapsed(bucket.acquire) < 0.8
+
+
+def test_pause_applies_even_with_full_bucket():
+    bucket = TokenBucket(rate=1000, capacity=1000)
+    bucket.pause(0.1)
+    assert bucket._take() > 0.09
+
+
+def test_idle_bucket_is_full():
+    bucket = TokenBucket(rate=100, capacity=1)
+    bucket.acquire()
+    assert not bucket.idle()
+    time.sleep(0.02)
+    assert bucket.idle()